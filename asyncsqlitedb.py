@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+An asyncio interface to SQLiteDB. The blocking work is done on
+threads so that the event loop is never stalled by the database.
+
+Usage:
+
+    from asyncsqlitedb import AsyncSQLiteDB
+
+    async with AsyncSQLiteDB('/path/to/db', readers=4) as db:
+        await db.execute_SQL('INSERT INTO t VALUES (?)', 1)
+        rows = await db.execute_SQL('SELECT * FROM t')
+        async for row in db.stream_SQL('SELECT * FROM big_table'):
+            ....
+
+All statements that change the database run, in the order they were
+submitted, on one writer thread that holds its own connection for its
+whole life. So a transaction can be spread across several awaits:
+
+        await db.execute_SQL('...', transaction=True)
+        await db.execute_SQL('...', transaction=True)
+        await db.commit()
+
+SELECTs run on a small pool of reader threads, each using a connection
+from the SQLiteDB pool. A SELECT waits for the writes submitted before
+it, so it sees those that have been committed. Writes made with 
+transaction=True are not visible to the readers until the commit().
+
+Leaving an async for over stream_SQL() early leaves the generator, and
+its pooled connection, open until the generator is collected or the
+database is closed. To release it at once:
+
+        async with contextlib.aclosing(db.stream_SQL('SELECT ...')) as rows:
+            async for row in rows:
+                if done(row): break
+"""
+
+import typing
+from   typing import *
+
+min_py = (3, 8)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import asyncio
+from   concurrent.futures import ThreadPoolExecutor
+import functools
+
+###
+# imports and objects that are a part of this project
+###
+from   sqlitedb import SQLiteDB
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu', 'me@georgeflanagin.com']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+class AsyncSQLiteDB: pass
+class AsyncSQLiteDB:
+    """
+    Awaitable versions of execute_SQL, executemany_SQL, row_one and
+    commit, and an async generator version of stream_SQL.
+    """
+
+    def __init__(self, path_to_db:str, readers:int=4, **kwargs):
+        """
+        path_to_db -- as for SQLiteDB.
+        readers    -- the number of threads that run SELECTs. With
+            to_RAM, there is only one connection, and everything
+            runs on the writer thread.
+        kwargs     -- passed to SQLiteDB. pool_size defaults to enough
+            connections for the writer, each reader, and as many
+            concurrent stream_SQL iterations as there are readers.
+        """
+        kwargs.setdefault('pool_size', 2 * readers + 1)
+        kwargs.setdefault('use_pandas', False)
+
+        self.writer = ThreadPoolExecutor(max_workers=1,
+            thread_name_prefix='sqlite-writer')
+
+        # The SQLiteDB is built on the writer thread so that its
+        # main connection belongs to the thread that will close it.
+        self.db = self.writer.submit(SQLiteDB, path_to_db, **kwargs).result()
+        if not self.db:
+            raise Exception(f"Unable to open {path_to_db}")
+
+        if self.db.pool is None:
+            self.readers = self.writer
+        else:
+            self.readers = ThreadPoolExecutor(max_workers=max(readers, 1),
+                thread_name_prefix='sqlite-reader')
+            self.writer.submit(self._pin).result()
+
+        self.pending = None
+        self.closed = False
+        self.streams = set()
+
+
+    def _pin(self) -> None:
+        """
+        Give the writer thread a connection of its own until close().
+        """
+        self.db.pool.local.db = self.db.pool.checkout()
+
+
+    async def __aenter__(self) -> AsyncSQLiteDB:
+        return self
+
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+
+    async def _write(self, fn:Callable, *args, **kwargs) -> object:
+        """
+        Queue fn on the writer thread, and remember it so that
+        later reads can wait for it.
+        """
+        loop = asyncio.get_running_loop()
+        future = self.pending = loop.run_in_executor(self.writer,
+            functools.partial(fn, *args, **kwargs))
+        return await future
+
+
+    async def _read(self, fn:Callable, *args, **kwargs) -> object:
+        """
+        Run fn on a reader thread after the writes that were submitted
+        before it have finished.
+        """
+        pending = self.pending
+        if pending is not None and not pending.done():
+            await asyncio.wait((pending,))
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.readers,
+            functools.partial(fn, *args, **kwargs))
+
+
+    async def execute_SQL(self, SQL:str, *args, **kwargs) -> object:
+        """
+        SELECTs are run on a reader; everything else on the writer.
+        """
+        if self.db.statement(SQL).is_select and kwargs.get('transaction') is None:
+            return await self._read(self.db.execute_SQL, SQL, *args, **kwargs)
+        return await self._write(self.db.execute_SQL, SQL, *args, **kwargs)
+
+
+    async def executemany_SQL(self, SQL:str, datasource:Iterable, **kwargs) -> object:
+        return await self._write(self.db.executemany_SQL, SQL, datasource, **kwargs)
+
+
+    async def row_one(self, SQL:str, parameters:Union[tuple, None]=None) -> object:
+        return await self._read(self.db.row_one, SQL, parameters)
+
+
+    async def commit(self) -> bool:
+        return await self._write(self.db.commit)
+
+
+    async def stream_SQL(self, SQL:str, *args, batch_size:int=1000) -> AsyncIterator:
+        """
+        async for row in db.stream_SQL(...) reads the rows batch_size
+        at a time on the reader threads.
+        """
+        pending = self.pending
+        if pending is not None and not pending.done():
+            await asyncio.wait((pending,))
+
+        loop = asyncio.get_running_loop()
+        rows = self.db.stream_SQL(SQL, *args, batch_size=batch_size, batches=True)
+        self.streams.add(rows)
+        try:
+            while True:
+                batch = await loop.run_in_executor(self.readers, next, rows, None)
+                if batch is None: break
+                for row in batch:
+                    yield row
+
+        finally:
+            self.streams.discard(rows)
+            # After close(), the readers are gone, and close() has
+            # already closed rows, so this does nothing.
+            if self.closed:
+                rows.close()
+            else:
+                await loop.run_in_executor(self.readers, rows.close)
+
+
+    async def close(self) -> bool:
+        """
+        Let the readers finish, then close the database on the writer
+        thread, where it was opened. The waiting is done on a thread of
+        the loop's default executor, so that the loop carries on while
+        a long SELECT finishes. The streams that were left open give 
+        back their connections first. Closing again does nothing.
+        """
+        if self.closed: return True
+        self.closed = True
+
+        loop = asyncio.get_running_loop()
+        if self.readers is not self.writer:
+            await loop.run_in_executor(None,
+                functools.partial(self.readers.shutdown, wait=True))
+        streams, self.streams = self.streams, set()
+        for rows in streams:
+            await self._write(rows.close)
+        try:
+            return await self._write(self.db.close)
+        finally:
+            await loop.run_in_executor(None,
+                functools.partial(self.writer.shutdown, wait=True))
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+
+    async def demo(name:str) -> None:
+        async with AsyncSQLiteDB(name, readers=4) as db:
+            await db.execute_SQL('CREATE TABLE IF NOT EXISTS t (a INTEGER)')
+            await db.executemany_SQL('INSERT INTO t VALUES (?)',
+                ((i,) for i in range(100000)), chunk_size=10000)
+
+            start = time.perf_counter()
+            counts = await asyncio.gather(*(
+                db.row_one('SELECT COUNT(*) FROM t WHERE a % 7 = ?', i)
+                for i in range(7) ))
+            print(f"{counts} in {time.perf_counter() - start:.3f}s")
+
+            total = 0
+            async for row in db.stream_SQL('SELECT a FROM t'):
+                total += row[0]
+            print(f"{total=}")
+
+    asyncio.run(demo(os.path.join(tempfile.gettempdir(), 'asyncsqlitedb_demo.db')))
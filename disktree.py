@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+"""
+SloppyTrees that are larger than memory. A DiskTree keeps the subtrees
+at one level of a tree -- the history of each job, say, or the metadata
+of each file -- as rows of an SQLite database, and reads each one only
+when it is used. The most recently used are kept in memory, up to
+cache_size of them.
+
+Usage:
+
+    t = DiskTree('/scratch/jobs.db', level=2)
+    t.jobs[jobid].state = 'running'    # reads (or creates) jobs.jobid
+    for jobid in t.jobs: ...
+    t.close()                          # writes back what has changed
+
+Above the level, the tree has no nodes of its own: t.jobs is a view of
+the rows whose first key is 'jobs', and costs nothing to make. At the
+level and below, the nodes are SloppyTrees, with the usual dot access.
+A subtree is written back when it leaves the cache, or at flush() or
+close(), and only if it has changed. The changes are committed at
+flush() and close().
+
+The keys above and at the level are columns of the table, so they must
+be types that sqlite stores: str, int, float, or bytes. The subtrees
+are pickled, so only open databases that you trust.
+
+NOTE: keep a subtree only while you are using it. Once it has left the
+cache, changes to it are lost; look it up again instead. An empty
+subtree that was looked at, but never given anything, is not stored.
+"""
+
+import typing
+from   typing import *
+
+min_py = (3, 8)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+from   collections import OrderedDict
+from   collections.abc import Mapping
+import hashlib
+import pickle
+
+###
+# From hpclib
+###
+from   sloppytree import SloppyTree, missing
+from   sqlitedb import SQLiteDB
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu', 'me@georgeflanagin.com']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+def fingerprint(data:bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def phantom(v:object, stamp:Optional[bytes]) -> bool:
+    """
+    True for a subtree that was created by looking it up, and has 
+    been given nothing since.
+    """
+    return stamp is None and isinstance(v, dict) and not v
+
+
+class DiskBranch:
+    """
+    The part of a DiskTree above the stored level whose path begins
+    with prefix. Reading a key gives the next branch down, or at the
+    level, the stored subtree.
+    """
+    __slots__ = ('_tree', '_prefix')
+
+    def __init__(self, tree:object, prefix:tuple):
+        object.__setattr__(self, '_tree', tree)
+        object.__setattr__(self, '_prefix', prefix)
+
+
+    def __getattr__(self, k:str) -> object:
+        if k.startswith('__') or k.startswith('_'):
+            raise AttributeError(f"No element named {k}")
+        return self[k]
+
+
+    def __setattr__(self, k:str, v:object) -> None:
+        self[k] = v
+
+
+    def __delattr__(self, k:str) -> None:
+        if k in self: del self[k]
+
+
+    def __getitem__(self, k:Hashable) -> object:
+        """
+        Like a SloppyTree, a key that is not there is created. A tuple
+        is a path of keys.
+        """
+        if isinstance(k, tuple):
+            node = self
+            for _ in k:
+                node = node[_]
+            return node
+
+        path = self._prefix + (k,)
+        if len(path) < self._tree._level: return DiskBranch(self._tree, path)
+        return self._tree._resident(path)
+
+
+    def __setitem__(self, k:Hashable, v:object) -> None:
+        """
+        At the level, v becomes the stored subtree. Above it, v must be
+        a mapping, and replaces everything below k.
+        """
+        if isinstance(k, tuple):
+            if not k: raise KeyError(k)
+            node = self[k[:-1]] if len(k) > 1 else self
+            node[k[-1]] = v
+            return
+
+        path = self._prefix + (k,)
+        if len(path) == self._tree._level:
+            self._tree._store(path, v)
+            return
+
+        if not isinstance(v, Mapping):
+            raise TypeError(f"Only a mapping can be placed at {path}, above the stored level.")
+        self._tree._delete(path)
+        branch = DiskBranch(self._tree, path)
+        for key, value in v.items():
+            branch[key] = value
+
+
+    def __delitem__(self, k:Hashable) -> None:
+        path = self._prefix + (k,)
+        if not self._tree._delete(path): raise KeyError(k)
+
+
+    def __call__(self, key_as_str:str) -> object:
+        """
+        t("a.b.c") means t.a.b.c, but without creating anything.
+        """
+        keys = key_as_str.split('.')
+        stored = self._tree._level - len(self._prefix)
+        path = self._prefix + tuple(keys[:stored])
+        v = self._tree._resident(path, False) if len(path) == self._tree._level else missing
+        if v is missing:
+            raise AttributeError(f"{'.'.join(map(str, path))} not found in {self._tree}")
+        rest = keys[stored:]
+        return v('.'.join(rest)) if rest else v
+
+
+    def __contains__(self, k:Hashable) -> bool:
+        return self._tree._contains(self._prefix + (k,))
+
+
+    def __iter__(self) -> Iterator:
+        return iter(self._tree._keys(self._prefix))
+
+
+    def __len__(self) -> int:
+        """
+        The number of keys in this branch, as for a dict.
+        """
+        return self._tree._count(self._prefix)
+
+
+    def __repr__(self) -> str:
+        return f"DiskBranch({self._tree}, {self._prefix})"
+
+
+    def keys(self) -> List[Hashable]:
+        return self._tree._keys(self._prefix)
+
+
+    def items(self) -> Iterable[Tuple[Hashable, object]]:
+        for k in self.keys():
+            yield k, self[k]
+
+
+    def values(self) -> Iterable[object]:
+        for k in self.keys():
+            yield self[k]
+
+
+    def flatten(self) -> Iterable[Tuple[tuple, object]]:
+        """
+        The (path, value) pairs for the leaves, as SloppyTree.flatten()
+        gives them, with the whole path from the top of the DiskTree.
+        The subtrees are read one at a time, and those not already in
+        the cache are not added to it.
+        """
+        for path, v in self._tree._subtrees(self._prefix):
+            if isinstance(v, SloppyTree):
+                for below, leaf in v.flatten():
+                    yield path + below, leaf
+                if not v: yield path, {}
+            else:
+                yield path, v
+
+
+class DiskTree: pass
+class DiskTree(DiskBranch):
+    """
+    A tree whose subtrees at depth level are stored in an SQLite table,
+    and read as they are needed. See above.
+    """
+    __slots__ = ('_db', '_name', '_table', '_level', '_cache', '_cache_size',
+        '_where', '_stats')
+
+    def __init__(self, path_to_db:str, level:int=1, cache_size:int=256,
+            table:str='sloppytree', **kwargs):
+        """
+        path_to_db -- the database, which is created if need be.
+        level      -- the depth of the stored subtrees; 1 means each key
+            of the top of the tree. For an existing table, it must
+            match the level with which the table was made.
+        cache_size -- the most subtrees kept in memory.
+        table      -- the name of the table.
+        kwargs     -- passed to SQLiteDB.
+        """
+        if level < 1: raise ValueError("level must be at least 1.")
+        if cache_size < 1: raise ValueError("cache_size must be at least 1.")
+        if not table.isidentifier(): raise ValueError(f"{table=} is not a valid table name.")
+
+        super().__init__(self, ())
+        kwargs['use_pandas'] = False
+        setattr_ = lambda k, v: object.__setattr__(self, k, v)
+        setattr_('_db', SQLiteDB(path_to_db, **kwargs))
+        if not self._db: raise OSError(f"Cannot open {path_to_db}")
+        setattr_('_name', self._db.name)
+        setattr_('_table', table)
+        setattr_('_cache', OrderedDict())
+        setattr_('_cache_size', cache_size)
+        setattr_('_stats', dict.fromkeys(('hits', 'misses', 'reads', 'writes', 'unchanged'), 0))
+
+        columns = [ row[1] for row in self._db.execute_SQL(f'pragma table_info({table})') ]
+        if columns:
+            existing = sum(1 for _ in columns if _ != 'data')
+            if existing != level:
+                self._db.close()
+                raise ValueError(f"{table} in {path_to_db} was made with level={existing}, not {level}.")
+        else:
+            keys = ', '.join(f'k{i}' for i in range(level))
+            self._db.execute_SQL(f'CREATE TABLE {table} ({keys}, data BLOB, PRIMARY KEY ({keys}))')
+        setattr_('_level', level)
+
+        # The WHERE clause that matches the first n keys.
+        setattr_('_where', [ ' AND '.join(f'k{i} = ?' for i in range(n)) or '1'
+            for n in range(level + 1) ])
+
+
+    def __str__(self) -> str:
+        return f"{self._name}:{self._table}"
+
+
+    def __repr__(self) -> str:
+        return f"DiskTree({self._name!r}, level={self._level}, table={self._table!r})"
+
+
+    def __enter__(self) -> DiskTree:
+        return self
+
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+    def _resident(self, path:tuple, create:bool=True) -> object:
+        """
+        The subtree at path, from the cache, or else from the database.
+        If it is in neither, a new SloppyTree if create, else missing.
+        """
+        cache = self._cache
+        try:
+            entry = cache[path]
+            cache.move_to_end(path)
+            self._stats['hits'] += 1
+            return entry[0]
+        except KeyError as e:
+            pass
+
+        self._stats['misses'] += 1
+        rows = self._db.execute_SQL(
+            f'SELECT data FROM {self._table} WHERE {self._where[-1]}', *path)
+        if rows:
+            self._stats['reads'] += 1
+            data = rows[0][0]
+            v, stamp = pickle.loads(data), fingerprint(data)
+        elif not create:
+            return missing
+        else:
+            # None marks a subtree that is stored only if it is given
+            # something.
+            v, stamp = SloppyTree(), None
+
+        cache[path] = [v, stamp]
+        self._evict()
+        return v
+
+
+    def _store(self, path:tuple, v:object) -> None:
+        """
+        Make v the subtree at path. It is written when it leaves the
+        cache, like any other change.
+        """
+        self._cache[path] = [v, b'']
+        self._cache.move_to_end(path)
+        self._evict()
+
+
+    def _evict(self) -> None:
+        cache = self._cache
+        while len(cache) > self._cache_size:
+            path, (v, stamp) = cache.popitem(last=False)
+            self._write(path, v, stamp)
+
+
+    def _write(self, path:tuple, v:object, stamp:Optional[bytes]) -> Optional[bytes]:
+        """
+        Write v if it differs from what was read, whose fingerprint is
+        stamp.
+
+        returns -- the fingerprint of what is now stored.
+        """
+        if phantom(v, stamp): return None
+        data = pickle.dumps(v, protocol=5)
+        new_stamp = fingerprint(data)
+        if new_stamp == stamp:
+            self._stats['unchanged'] += 1
+            return stamp
+
+        self._stats['writes'] += 1
+        # An upsert, rather than INSERT OR REPLACE, keeps the rowid,
+        # and so the order of the keys.
+        params = ', '.join('?' * (self._level + 1))
+        keys = ', '.join(f'k{i}' for i in range(self._level))
+        self._db.execute_SQL(f'INSERT INTO {self._table} VALUES ({params}) '
+            f'ON CONFLICT ({keys}) DO UPDATE SET data = excluded.data',
+            *path, data, transaction=True)
+        return new_stamp
+
+
+    def _delete(self, prefix:tuple) -> bool:
+        """
+        Remove prefix and everything below it.
+
+        returns -- True if anything was there.
+        """
+        n = len(prefix)
+        doomed = [ path for path, (v, stamp) in self._cache.items()
+            if path[:n] == prefix and not phantom(v, stamp) ]
+        for path in [ _ for _ in self._cache if _[:n] == prefix ]:
+            del self._cache[path]
+        cursor = self._db.execute_SQL(f'DELETE FROM {self._table} WHERE {self._where[n]}',
+            *prefix, transaction=True)
+        return bool(doomed) or cursor.rowcount > 0
+
+
+    def _keys(self, prefix:tuple) -> List[Hashable]:
+        """
+        The keys one level below prefix, on disc or only in the cache,
+        in the order they were first stored.
+        """
+        n = len(prefix)
+        if n >= self._level: raise KeyError(f"{prefix} is not above the stored level.")
+        column = f'k{n}'
+        keys = [ row[0] for row in self._db.execute_SQL(
+            f'SELECT {column} FROM {self._table} WHERE {self._where[n]} '
+            f'GROUP BY {column} ORDER BY min(rowid)', *prefix) ]
+        on_disc = set(keys)
+        for path, (v, stamp) in self._cache.items():
+            if path[:n] == prefix and path[n] not in on_disc and not phantom(v, stamp):
+                on_disc.add(path[n])
+                keys.append(path[n])
+        return keys
+
+
+    def _on_disc(self, prefix:tuple) -> bool:
+        """
+        True if a row is stored at or below prefix.
+        """
+        return bool(self._db.execute_SQL(
+            f'SELECT 1 FROM {self._table} WHERE {self._where[len(prefix)]} LIMIT 1', *prefix))
+
+
+    def _contains(self, prefix:tuple) -> bool:
+        """
+        True if anything is stored at or below prefix, on disc or 
+        only in the cache, without reading the other keys.
+        """
+        n = len(prefix)
+        if n == self._level:
+            entry = self._cache.get(prefix)
+            if entry is not None: return not phantom(*entry)
+        elif any(path[:n] == prefix and not phantom(v, stamp) 
+                for path, (v, stamp) in self._cache.items()):
+            return True
+        return self._on_disc(prefix)
+
+
+    def _count(self, prefix:tuple) -> int:
+        """
+        The number of keys one level below prefix, as _keys() would
+        find them, counted by the database.
+        """
+        n = len(prefix)
+        if n >= self._level: raise KeyError(f"{prefix} is not above the stored level.")
+        count = self._db.execute_SQL(f'SELECT COUNT(DISTINCT k{n}) FROM {self._table} '
+            f'WHERE {self._where[n]}', *prefix)[0][0]
+
+        # A subtree with a stamp has been read from, or written to, the
+        # disc. The keys of the others in the cache may be new.
+        stored, new = set(), set()
+        for path, (v, stamp) in self._cache.items():
+            if path[:n] != prefix or phantom(v, stamp): continue
+            (stored if stamp else new).add(path[n])
+        return count + sum(1 for k in new - stored if not self._on_disc(prefix + (k,)))
+
+
+    def _subtrees(self, prefix:tuple) -> Iterable[Tuple[tuple, object]]:
+        """
+        Each stored path below prefix, and its subtree, reading the rows
+        in order and preferring the copy in the cache.
+        """
+        self.flush()
+        n = len(prefix)
+        keys = ', '.join(f'k{i}' for i in range(self._level))
+        for row in self._db.stream_SQL(f'SELECT {keys}, data FROM {self._table} '
+                f'WHERE {self._where[n]} ORDER BY rowid', *prefix):
+            path = tuple(row[:-1])
+            entry = self._cache.get(path)
+            yield path, entry[0] if entry is not None else pickle.loads(row[-1])
+
+
+    def flush(self) -> None:
+        """
+        Write the subtrees in the cache that have changed, and commit.
+        They stay in the cache.
+        """
+        for path, entry in self._cache.items():
+            entry[1] = self._write(path, *entry)
+        self._db.commit()
+
+
+    def close(self) -> None:
+        """
+        Write back what has changed, empty the cache, and close the
+        database.
+        """
+        if self._db is None: return
+        self.flush()
+        self._cache.clear()
+        self._db.close()
+        object.__setattr__(self, '_db', None)
+
+
+    def stats(self) -> dict:
+        """
+        hits and misses of the cache, and the reads and writes of rows.
+        unchanged is the number of subtrees that were not written back
+        because they had not changed.
+        """
+        return dict(self._stats, resident=len(self._cache), cache_size=self._cache_size)
@@ -71,12 +71,15 @@ if sys.version_info < min_py:
 # Other standard distro imports
 ###
 from   collections import namedtuple
+from   collections import OrderedDict
 from   collections.abc import Callable
 from   collections.abc import Iterable
+import contextlib
 import datetime
 from   functools import wraps
 import re
 import string
+import threading
 import warnings
 
 ##########################################################################
@@ -118,6 +121,9 @@ AT_SIGN = '@'
 BANG    = '!'
 PERCENT = '%'
 
+# The number of results that a Memo keeps. See SECTION 3B.
+memo_size = 1 << 16
+
 
 ##########################################################################
 # SECTION 1: Parsec.Error
@@ -285,6 +291,31 @@ class Parser:
         return self.fn(text, index)
 
 
+    def memo_call(self, text:str, index:int) -> Value:
+        '''
+        Within packrat(), this is __call__, and the result is looked up
+        in the Memo of this thread's session, if it has one.
+        '''
+        memo = sessions.memo
+        return self.fn(text, index) if memo is None else memo.lookup(self, text, index)
+
+
+    def memoize(self, size:int=memo_size) -> Parser:
+        '''
+        Returns a parser that keeps the results of this one in a Memo
+        of its own, which is available as its .memo attribute. See
+        SECTION 3B.
+        '''
+        memo = Memo(size)
+
+        @Parser
+        def memo_parser(text:str, index:int):
+            return memo.lookup(self, text, index)
+
+        memo_parser.memo = memo
+        return memo_parser
+
+
     def parse(self, text:str):
         '''
         text -- the text to be parsed.
@@ -553,6 +584,122 @@ class Parser:
         return self.excepts(other)
 
 
+##########################################################################
+# SECTION 3B: Packrat memoization.
+#
+# A parser that backtracks with try_choice (^) may apply the same parser
+# at the same index over and over, and with nested alternatives, the
+# work can grow exponentially with the depth of the nesting. A Memo 
+# keeps the Value of each (parser, index) that has been tried, so that
+# each is parsed only once. This is opt-in, in one of two ways:
+#
+#    p = p.memoize()            -- only p's results are kept.
+#    with packrat() as memo:    -- every parser's results are kept,
+#        p.parse(text)             until the end of the with block.
+#
+# The table holds at most size results, and the oldest are dropped
+# first. It is cleared when it is asked about a different text, so 
+# the results are only ever used for the text they came from.
+#
+# NOTE: the parsers must depend only on the text and the index, and a
+# result that is used more than once is the same object each time. A
+# memoized parser takes one more stack frame per call, so a deeply
+# recursive grammar may need a higher sys.setrecursionlimit(). A 
+# packrat session applies only to the thread that opened it, but
+# parsing in other threads pays for one check per call while any
+# session is open.
+##########################################################################
+class Memo:
+    """
+    A bounded table of (parser, index) -> Value for one text at a time,
+    with the counts of the hits and misses.
+    """
+
+    def __init__(self, size:int=memo_size):
+        self.size = size
+        self.table = OrderedDict()
+        self.text = None
+        self.hits = 0
+        self.misses = 0
+        self.parses = 0
+
+
+    def clear(self, text:str=None) -> None:
+        """
+        Forget the results, and start over with text.
+        """
+        self.table.clear()
+        self.text = text
+        if text is not None: self.parses += 1
+
+
+    def lookup(self, parser:Parser, text:str, index:int) -> Value:
+        """
+        The result of the parser at this index, from the table if it has
+        been tried before.
+        """
+        if text is not self.text: self.clear(text)
+        key = (parser, index)
+        result = self.table.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        result = self.table[key] = parser.fn(text, index)
+        if len(self.table) > self.size: self.table.popitem(last=False)
+        return result
+
+
+    def stats(self) -> dict:
+        """
+        The hits and misses since the Memo was created, and the number
+        of results in the table now.
+        """
+        tries = self.hits + self.misses
+        return {'parses': self.parses, 'hits': self.hits, 'misses': self.misses, 
+            'hit_rate': round(self.hits / tries, 4) if tries else None, 
+            'entries': len(self.table), 'size': self.size}
+
+
+###
+# Each thread's packrat() sessions nest, and sessions.memo is the
+# Memo of the innermost. While any thread has a session open,
+# Parser.memo_call replaces Parser.__call__, so that parsing when
+# there are none does not pay for checking.
+###
+class Sessions(threading.local):
+    memo = None
+
+sessions = Sessions()
+open_sessions = 0
+sessions_lock = threading.Lock()
+plain_call = Parser.__call__
+
+@contextlib.contextmanager
+def packrat(size:int=memo_size) -> Memo:
+    """
+    Memoize every parser while the with block is active.
+
+        with packrat() as memo:
+            result = grammar.parse(text)
+        print(memo.stats())
+    """
+    global open_sessions
+    memo = Memo(size)
+    previous, sessions.memo = sessions.memo, memo
+    with sessions_lock:
+        open_sessions += 1
+        Parser.__call__ = Parser.memo_call
+    try:
+        yield memo
+    finally:
+        sessions.memo = previous
+        with sessions_lock:
+            open_sessions -= 1
+            if not open_sessions: Parser.__call__ = plain_call
+
+
 ###
 # SECTION 4: In this section, along with parse(), we have some of 
 # the class member functions exposed to the outside primarily for 
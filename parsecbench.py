@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for parsec4. Each measurement is written as one line of
+JSON, like those of sqlitebench and sloppybench, so that the results
+of different releases and machines can be collected in a file and
+compared.
+
+Usage:
+
+    python parsecbench.py --depths 2,4,6,8 -o results.jsonl
+
+The grammar is arithmetic in which every alternative is tried with
+try_choice (^), and the alternatives share their first term:
+
+    expr = term + '+' + expr ^ term + '-' + expr ^ term + '*' + expr ^ term
+    term = number ^ '(' + expr + ')'
+
+so that a term in parentheses nested depth deep is parsed about 4**depth
+times without memoization. Each text is parsed
+
+    plain    -- as parsec4 always has.
+    parser   -- with term and expr memoized by .memoize().
+    packrat  -- with every parser memoized, within packrat().
+
+The texts are the nested term, for each of --depths, and a flat sum of
+--terms numbers, which does little backtracking, to show the cost of
+memoization where it does not help. The hits and misses of the memos
+are included.
+"""
+import typing
+from   typing import *
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import argparse
+import contextlib
+import datetime
+import json
+import platform
+import time
+
+###
+# From hpclib
+###
+import parsec4
+from   parsec4 import Parser, DIGIT_STR, lexeme, packrat, string
+from   urdecorators import trap
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = f'gflanagin@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+###
+# Global objects
+###
+context = {}
+
+
+def emit(op:str, seconds:float, **kwargs) -> None:
+    """
+    Print one result as a line of JSON.
+    """
+    print(json.dumps(dict(context, op=op, seconds=round(seconds, 6), **kwargs)), flush=True)
+
+
+@contextlib.contextmanager
+def stopwatch() -> List[float]:
+    """
+    with stopwatch() as t: ... leaves the elapsed time in t[0].
+    """
+    t = [time.perf_counter()]
+    yield t
+    t[0] = time.perf_counter() - t[0]
+
+
+def grammar(memoize:bool=False, size:int=parsec4.memo_size) -> Dict[str, Parser]:
+    """
+    The parsers of the expression grammar, by name, with term and expr
+    memoized if memoize.
+    """
+    parsers = {}
+
+    # expr refers to itself, so it is looked up when it is called.
+    @Parser
+    def expr_ref(text:str, index:int):
+        return parsers['expr'](text, index)
+
+    number = lexeme(DIGIT_STR)
+    term = number ^ (lexeme(string('(')) >> expr_ref << lexeme(string(')')))
+    if memoize: term = term.memoize(size)
+    expr = ( (term + lexeme(string('+')) + expr_ref)
+           ^ (term + lexeme(string('-')) + expr_ref)
+           ^ (term + lexeme(string('*')) + expr_ref)
+           ^ term )
+    if memoize: expr = expr.memoize(size)
+    parsers['expr'] = expr
+    parsers['term'] = term
+    return parsers
+
+
+def nested(depth:int) -> str:
+    """
+    1 inside depth pairs of parentheses.
+    """
+    return '(' * depth + '1' + ')' * depth
+
+
+def flat(n:int) -> str:
+    """
+    A sum of n numbers.
+    """
+    return ' + '.join(str(i) for i in range(n))
+
+
+@trap
+def parsecbench_main(myargs:argparse.Namespace) -> int:
+
+    context.update({
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'parsec4': parsec4.__version__,
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'memo_size': myargs.memo_size
+        })
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100 * myargs.terms))
+
+    texts = [ ('nested', depth, nested(depth)) for depth in
+        (int(_) for _ in myargs.depths.split(',')) ]
+    texts.append(('flat', myargs.terms, flat(myargs.terms)))
+
+    for shape, n, text in texts:
+        for how in ('plain', 'parser', 'packrat'):
+            if how == 'plain' and shape == 'nested' and n > myargs.max_plain:
+                continue
+
+            parsers = grammar(how == 'parser', myargs.memo_size)
+            with stopwatch() as t:
+                with packrat(myargs.memo_size) if how == 'packrat' else contextlib.nullcontext() as memo:
+                    parsers['expr'].parse_strict(text)
+
+            # The hits and misses of term and expr are added together.
+            memos = [memo] if memo else [ parsers[_].memo for _ in ('term', 'expr') ] if how == 'parser' else []
+            hits, misses = sum(_.hits for _ in memos), sum(_.misses for _ in memos)
+            stats = {'hits': hits, 'misses': misses, 
+                'hit_rate': round(hits / (hits + misses), 4)} if memos else {}
+            emit('parse', t[0], text=shape, n=n, how=how, chars=len(text), **stats)
+
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+
+    here       = os.getcwd()
+    progname   = os.path.basename(__file__)[:-3]
+
+    parser = argparse.ArgumentParser(prog="parsecbench",
+        description="Time parsec4 with and without packrat memoization, and write the results as JSON lines.")
+
+    parser.add_argument('-d', '--depths', type=str, default="2,4,6,8",
+        help="Comma separated list of the depths of the nested texts.")
+
+    parser.add_argument('--max-plain', type=int, default=8,
+        help="Deepest nested text to parse without memoization.")
+
+    parser.add_argument('--memo-size', type=int, default=parsec4.memo_size,
+        help="Most results kept by each memo.")
+
+    parser.add_argument('-o', '--output', type=str, default="",
+        help="Output file name")
+
+    parser.add_argument('-t', '--terms', type=int, default=200,
+        help="Number of terms in the flat text.")
+
+    myargs = parser.parse_args()
+
+    try:
+        outfile = sys.stdout if not myargs.output else open(myargs.output, 'a')
+        with contextlib.redirect_stdout(outfile):
+            sys.exit(globals()[f"{progname}_main"](myargs))
+
+    except Exception as e:
+        print(f"Escaped or re-raised exception: {e}")
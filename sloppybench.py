@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for sloppytree. Each measurement is written as one line of
+JSON, like those of sqlitebench, so that the results of different
+releases and machines can be collected in a file and compared.
+
+Usage:
+
+    python sloppybench.py --nodes 100000,1000000 -o results.jsonl
+
+The test trees look like a snapshot of a cluster:
+
+    t.partitions[p][node] = {'cores':..., 'ram':..., 'state':..., 'gpus':...}
+
+and --nodes is the number of compute nodes in the snapshot. The
+following are measured:
+
+    memory   -- the time to build the snapshot, and the bytes allocated
+                per tree node, for SloppyTree and CompactTree.
+    traverse -- traverse(), leaves(), and tree_as_table() of the snapshot,
+                a binary tree 20 levels deep (3M nodes), and a chain
+                --depth nodes deep, compared with the recursive 
+                generators that they replaced.
+    build    -- from_paths() on the flattened snapshot, compared with
+                assigning each path, and flatten() itself.
+    query    -- glob queries, with and without a PathIndex, and the
+                time to build the index.
+    serialize-- to_json/from_json and to_msgpack/from_msgpack, through a
+                file, compared with json.dump and json.load + deepsloppy;
+                and pickle, compared with pickling through __setitem__
+                as sloppytree 1.2 did.
+    frozen   -- freeze(), the first and a later hash(), and a new version
+                by set_in(), compared with copy.deepcopy().
+    diff     -- diff() of the snapshot and a copy with one change, as 
+                SloppyTrees and as frozen versions, compared with 
+                comparing the lines of their printable forms.
+    numpy    -- the total cores; the sum, min, max and mean of the ram;
+                and each node's share of the largest number of cores,
+                with gather() and scatter() (if numpy is present), 
+                compared with Python loops over the partitions.
+    lookups  -- a search of the snapshot for a key that no compute node
+                has, through the tree (which grows) and through a view
+                (which does not), with the bytes each allocated; then
+                traverse() before and after prune() removes the growth.
+    disk     -- a DiskTree holding each compute node as a row: storing 
+                the snapshot, reading every node with a cache of 1% and
+                of 100% of the nodes, reading them all again, and 
+                flatten().
+"""
+import typing
+from   typing import *
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import argparse
+from   collections.abc import Mapping
+import contextlib
+import copy
+import datetime
+import gc
+import io
+import json
+import pickle
+import platform
+import tempfile
+import time
+import tracemalloc
+
+###
+# From hpclib
+###
+from   disktree import DiskTree
+import sloppytree
+from   sloppytree import SloppyTree, CompactTree, deepsloppy, diff
+from   urdecorators import trap
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = f'gflanagin@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+###
+# Global objects
+###
+partitions = 16
+context = {}
+
+
+def emit(op:str, seconds:float, **kwargs) -> None:
+    """
+    Print one result as a line of JSON.
+    """
+    print(json.dumps(dict(context, op=op, seconds=round(seconds, 6), **kwargs)), flush=True)
+
+
+@contextlib.contextmanager
+def stopwatch() -> List[float]:
+    """
+    with stopwatch() as t: ... leaves the elapsed time in t[0].
+    """
+    t = [time.perf_counter()]
+    yield t
+    t[0] = time.perf_counter() - t[0]
+
+
+def snapshot(cls:type, n:int) -> object:
+    """
+    A tree of class cls that describes n compute nodes.
+    """
+    t = cls()
+    states = ('idle', 'mixed', 'allocated', 'down')
+    for i in range(n):
+        node = t.partitions[f'p{i % partitions:02d}'][f'node{i:07d}']
+        node.cores = 48
+        node.ram = 384 << (i % 3)
+        node.state = states[i % 4]
+        node.gpus = i % 5
+    return t
+
+
+###
+# The recursive versions of traverse(), leaves() and tree_as_table()
+# from sloppytree 1.2, for comparison.
+###
+def recursive_traverse(t:dict) -> Iterable:
+    for k, v in t.items():
+        yield k, 1
+        if isinstance(v, dict):
+            yield from recursive_traverse(v)
+        else:
+            yield v, 0
+
+
+def recursive_leaves(t:dict) -> Iterable:
+    for k, v in t.items():
+        if isinstance(v, dict):
+            if v == {}: yield v
+            yield from recursive_leaves(v)
+        else:
+            yield v
+
+
+def recursive_table(t:dict, prepath:tuple=()) -> Iterable:
+    for k, v in t.items():
+        path = prepath + (k,)
+        if isinstance(v, dict):
+            if v == {}: 
+                yield path
+            else:
+                yield from recursive_table(v, path)
+        else:
+            yield path + (v,)
+
+
+def old_pickle(t:SloppyTree) -> tuple:
+    """
+    The reduction of sloppytree 1.2, for a pickler's dispatch_table.
+    """
+    return (type(t), (), None, None, iter(dict.items(t)))
+
+
+def chain(depth:int) -> SloppyTree:
+    """
+    A tree that is one path, depth nodes long.
+    """
+    t = node = SloppyTree()
+    for i in range(depth):
+        node = node[i]
+    node.leaf = 1
+    return t
+
+
+def binary(depth:int) -> SloppyTree:
+    """
+    A complete binary tree, depth levels deep, with numbered leaves.
+    """
+    t = SloppyTree()
+    level = [t]
+    for i in range(depth - 1):
+        level = [ node[side] for node in level for side in (0, 1) ]
+    for i, node in enumerate(level):
+        node[0], node[1] = 2*i, 2*i + 1
+    return t
+
+
+def count_nodes(t:Mapping) -> int:
+    """
+    The number of mappings in the tree, including the root.
+    """
+    n, stack = 0, [t]
+    while stack:
+        node = stack.pop()
+        n += 1
+        stack.extend(v for v in node.values() if isinstance(v, Mapping))
+    return n
+
+
+@trap
+def sloppybench_main(myargs:argparse.Namespace) -> int:
+
+    context.update({
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'sloppytree': sloppytree.__version__,
+        'python': platform.python_version(),
+        'host': platform.node()
+        })
+
+    for n in (int(_) for _ in myargs.nodes.split(',')):
+        context['nodes'] = n
+
+        # memory. tracemalloc slows the build, so the build is timed
+        # separately.
+        for cls in (SloppyTree, CompactTree):
+            with stopwatch() as t:
+                tree = snapshot(cls, n)
+            del tree
+            gc.collect()
+            tracemalloc.start()
+            tree = snapshot(cls, n)
+            allocated, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            tree_nodes = count_nodes(tree)
+            emit('memory', t[0], cls=cls.__name__, tree_nodes=tree_nodes,
+                bytes=allocated, bytes_per_node=round(allocated / tree_nodes, 1))
+            del tree
+
+        # traverse
+        tree = snapshot(SloppyTree, n)
+        for shape, t in (('snapshot', tree), ('binary', binary(20)), 
+                ('chain', chain(myargs.depth))):
+            for name, method, recursive in (
+                    ('traverse', SloppyTree.traverse, recursive_traverse),
+                    ('leaves', SloppyTree.leaves, recursive_leaves),
+                    ('tree_as_table', SloppyTree.tree_as_table, recursive_table)):
+                for how, f in (('recursive', recursive), ('walk', method)):
+                    try:
+                        with stopwatch() as s:
+                            items = sum(1 for _ in f(t))
+                        emit('traverse', s[0], tree=shape, method=name, how=how,
+                            tree_nodes=len(t), items=items)
+                    except RecursionError as e:
+                        emit('traverse', 0, tree=shape, method=name, how=how,
+                            tree_nodes=len(t), error='RecursionError')
+        del tree, t
+
+        # build
+        tree = snapshot(SloppyTree, n)
+        with stopwatch() as t:
+            pairs = list(tree.flatten())
+        emit('flatten', t[0], paths=len(pairs))
+        with stopwatch() as t:
+            SloppyTree.from_paths(pairs)
+        emit('build', t[0], paths=len(pairs), how='from_paths')
+        with stopwatch() as t:
+            built = SloppyTree()
+            for path, value in pairs:
+                built[path] = value
+        emit('build', t[0], paths=len(pairs), how='setitem')
+        del built, pairs
+
+        # query
+        patterns = ('partitions.p01.*.ram', 'partitions.*.*.ram', '**.gpus', 
+            'partitions.**.node00000[0-9]?.state')
+        for indexed in (False, True):
+            if indexed:
+                with stopwatch() as t:
+                    tree.index()
+                emit('index', t[0], tree_nodes=len(tree))
+            for pattern in patterns:
+                with stopwatch() as t:
+                    found = tree.query(pattern)
+                emit('query', t[0], pattern=pattern, indexed=indexed, found=len(found))
+        tree.drop_index()
+
+        # serialize
+        with tempfile.TemporaryDirectory() as d:
+            name = os.path.join(d, 'tree')
+            for how, write, read in (
+                    ('json.dump', lambda: json.dump(tree, open(name, 'w')),
+                        lambda: deepsloppy(json.load(open(name)))),
+                    ('json', lambda: tree.to_json(name), 
+                        lambda: SloppyTree.from_json(name)),
+                    ('msgpack', lambda: tree.to_msgpack(name),
+                        lambda: SloppyTree.from_msgpack(name))):
+                with stopwatch() as t:
+                    write()
+                emit('serialize', t[0], how=how, direction='write', 
+                    file_bytes=os.path.getsize(name), msgpack=sloppytree.we_have_msgpack)
+                with stopwatch() as t:
+                    read()
+                emit('serialize', t[0], how=how, direction='read', 
+                    file_bytes=os.path.getsize(name), msgpack=sloppytree.we_have_msgpack)
+
+        for how in ('setitem', 'flat'):
+            f = io.BytesIO()
+            pickler = pickle.Pickler(f, protocol=5)
+            if how == 'setitem': pickler.dispatch_table = {SloppyTree: old_pickle}
+            with stopwatch() as t:
+                pickler.dump(tree)
+            emit('pickle', t[0], how=how, direction='dump', bytes=f.tell())
+            with stopwatch() as t:
+                pickle.loads(f.getvalue())
+            emit('pickle', t[0], how=how, direction='load', bytes=f.tell())
+
+        # frozen
+        with stopwatch() as t:
+            frozen = tree.freeze()
+        emit('frozen', t[0], method='freeze')
+        for which in ('first', 'cached'):
+            with stopwatch() as t:
+                hash(frozen)
+            emit('frozen', t[0], method='hash', which=which)
+        with stopwatch() as t:
+            for i in range(1000):
+                frozen = frozen.set_in(('partitions', 'p03', 'node0000003', 'state'), str(i))
+        emit('frozen', t[0] / 1000, method='set_in')
+        with stopwatch() as t:
+            copy.deepcopy(tree)
+        emit('frozen', t[0], method='deepcopy')
+
+        # diff
+        other = copy.deepcopy(tree)
+        other.partitions.p03.node0000003.state = 'idle'
+        with stopwatch() as t:
+            a, b = tree.printable.splitlines(), other.printable.splitlines()
+            found = sum(x != y for x, y in zip(a, b)) + abs(len(a) - len(b))
+        emit('diff', t[0], how='printable', found=found)
+        with stopwatch() as t:
+            found = len(diff(tree, other).changed)
+        emit('diff', t[0], how='SloppyTree', found=found)
+        new_version = frozen.set_in(('partitions', 'p03', 'node0000003', 'state'), 'idle')
+        with stopwatch() as t:
+            found = len(diff(frozen, new_version).changed)
+        emit('diff', t[0], how='FrozenSloppyTree', found=found)
+        del frozen, other, new_version
+
+        # numpy
+        with stopwatch() as t:
+            total = sum(node.cores for nodes in tree.partitions.values() for node in nodes.values())
+        emit('numpy', t[0], method='sum', how='loop', total=total)
+        with stopwatch() as t:
+            ram = [ node.ram for nodes in tree.partitions.values() for node in nodes.values() ]
+            summary = sum(ram), min(ram), max(ram), sum(ram) / len(ram)
+        emit('numpy', t[0], method='summary', how='loop', mean=round(summary[3], 3))
+        with stopwatch() as t:
+            biggest = max(node.cores for nodes in tree.partitions.values() for node in nodes.values())
+            for nodes in tree.partitions.values():
+                for node in nodes.values():
+                    node.share = node.cores / biggest
+        emit('numpy', t[0], method='share', how='loop')
+        if sloppytree.we_have_numpy:
+            with stopwatch() as t:
+                cores, paths = tree.gather('partitions.*.*.cores')
+                total = int(cores.sum())
+            emit('numpy', t[0], method='sum', how='gather', total=total)
+            with stopwatch() as t:
+                ram, _ = tree.gather('partitions.*.*.ram')
+                summary = ram.sum(), ram.min(), ram.max(), ram.mean()
+            emit('numpy', t[0], method='summary', how='gather', mean=round(float(summary[3]), 3))
+            with stopwatch() as t:
+                tree.scatter(paths, cores / cores.max(), key='share')
+            emit('numpy', t[0], method='share', how='scatter')
+
+        # lookups. Ask each compute node for something it does not 
+        # have, as an exploratory search would, through a view and 
+        # through the tree itself. As in memory, the allocations are 
+        # traced in a separate run, and what it adds to the tree is
+        # pruned before the timed run.
+        search = lambda root: sum(1 for nodes in root.partitions.values() 
+            for node in nodes.values() if node.jobs.running)
+        for how in ('view', 'tree'):
+            root = tree if how == 'tree' else tree.view()
+            gc.collect()
+            tracemalloc.start()
+            search(root)
+            allocated, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            if how == 'tree': tree.prune()
+            with stopwatch() as t:
+                found = search(root)
+            emit('lookups', t[0], how=how, found=found, bytes=allocated)
+        with stopwatch() as t:
+            traversed = sum(1 for _ in tree.traverse())
+        emit('lookups', t[0], method='traverse', pruned=False, found=traversed)
+        with stopwatch() as t:
+            reclaimed = tree.prune()
+        emit('lookups', t[0], method='prune', tree_nodes=count_nodes(tree), **reclaimed)
+        with stopwatch() as t:
+            traversed = sum(1 for _ in tree.traverse())
+        emit('lookups', t[0], method='traverse', pruned=True, found=traversed)
+
+        # disk
+        with tempfile.TemporaryDirectory() as d:
+            name = os.path.join(d, 'tree.db')
+            with stopwatch() as t:
+                with DiskTree(name, level=3, cache_size=1000) as disk:
+                    disk.partitions = tree.partitions
+            emit('disk', t[0], method='store', file_bytes=os.path.getsize(name))
+
+            paths = [ ('partitions', p, node) for p, nodes in tree.partitions.items()
+                for node in nodes.keys() ]
+            for cache_size in (max(len(paths) // 100, 1), len(paths)):
+                with DiskTree(name, level=3, cache_size=cache_size) as disk:
+                    for method in ('read', 'reread'):
+                        with stopwatch() as t:
+                            cores = sum(disk[path].cores for path in paths)
+                        emit('disk', t[0], method=method, **disk.stats())
+                    with stopwatch() as t:
+                        found = sum(1 for _ in disk.flatten())
+                    emit('disk', t[0], method='flatten', cache_size=cache_size, found=found)
+        del tree
+
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+
+    here       = os.getcwd()
+    progname   = os.path.basename(__file__)[:-3]
+
+    parser = argparse.ArgumentParser(prog="sloppybench",
+        description="Time and size the sloppytree classes, and write the results as JSON lines.")
+
+    parser.add_argument('--depth', type=int, default=100000,
+        help="Depth of the chain used to time traversals.")
+
+    parser.add_argument('-n', '--nodes', type=str, default="100000",
+        help="Comma separated list of the number of compute nodes in the test snapshots.")
+
+    parser.add_argument('-o', '--output', type=str, default="",
+        help="Output file name")
+
+    myargs = parser.parse_args()
+
+    try:
+        outfile = sys.stdout if not myargs.output else open(myargs.output, 'a')
+        with contextlib.redirect_stdout(outfile):
+            sys.exit(globals()[f"{progname}_main"](myargs))
+
+    except Exception as e:
+        print(f"Escaped or re-raised exception: {e}")
@@ -17,11 +17,37 @@ if sys.version_info < min_py:
 ###
 # Standard imports
 ###
-from collections.abc import Hashable
+import array
+import collections
+import contextlib
+import copy
+import io
+import itertools
+from collections import namedtuple
+from collections.abc import Hashable, Mapping, MutableMapping
+import fnmatch
+import gc
+import json
 import math
+import pickle
+import re
 import pprint
+import struct
+import threading
 from   functools import reduce
 
+try:
+    import msgpack
+    we_have_msgpack = True
+except Exception as e:
+    we_have_msgpack = False
+
+try:
+    import numpy
+    we_have_numpy = True
+except Exception as e:
+    we_have_numpy = False
+
 # Credits
 __author__ = 'George Flanagin'
 __copyright__ = 'Copyright 2021'
@@ -44,21 +70,92 @@ def sloppy(o:object) -> SloppyDict:
 
 def deepsloppy(o:dict) -> Union[SloppyDict, object]:
     """
-    Multi level slop.
+    Multi level slop. The dicts become SloppyTrees, and the lists
+    are converted in place. 
     """
     if isinstance(o, dict): 
         o = SloppyTree(o)
-        for k, v in o.items():
-            o[k] = deepsloppy(v)
+    elif not isinstance(o, list):
+        return o
+
+    stack = [o]
+    while stack:
+        container = stack.pop()
+        for k, v in list(container.items() if isinstance(container, dict) 
+                else enumerate(container)):
+            if isinstance(v, dict):
+                v = container[k] = SloppyTree(v)
+                stack.append(v)
+            elif isinstance(v, list):
+                stack.append(v)
 
-    elif isinstance(o, list):
-        for i, _ in enumerate(o):
-            o[i] = deepsloppy(_)
+    return o
 
-    else:
-        pass
 
-    return o
+def walk(t:dict, order:str='pre', paths:bool=False, 
+        leaves_only:bool=False) -> Iterable[Tuple[object, object]]:
+    """
+    Visit every key in t, and in the dicts below it, without recursion,
+    so that the depth of the tree does not matter. This is the engine
+    for SloppyTree's traverse(), leaves(), and tree_as_table().
+
+    order -- 'pre' visits each key before the keys below it, 'post'
+        visits it after them, and 'bfs' visits the tree one level at
+        a time. Within a dict, the keys are visited in order.
+    paths -- if True, yield the tuple of keys leading to each key
+        rather than the key alone.
+    leaves_only -- if True, skip the keys whose values are non-empty
+        dicts. 
+
+    yields -- (key, value) or (path, value)
+
+    Usage:
+        for path, v in walk(t, 'post', True): ....
+    """
+    if order == 'bfs':
+        queue = collections.deque([((), t)])
+        while queue:
+            prefix, d = queue.popleft()
+            for k, v in dict.items(d):
+                path = prefix + (k,) if paths else prefix
+                branch = isinstance(v, dict) and v
+                if branch: queue.append((path, v))
+                if not (leaves_only and branch): yield (path if paths else k), v
+        return
+
+    if order not in ('pre', 'post'):
+        raise ValueError(f"Unknown order {order}. Use 'pre', 'post', or 'bfs'.")
+
+    # keys holds the path to the dict being read, and stack holds
+    # (key, value, iterator) for each dict along the path. The path 
+    # as a tuple is made only when it is needed, and only the current
+    # one is kept, so that a very deep tree does not fill memory with
+    # the paths to each of its levels.
+    show_branches = order == 'pre' and not leaves_only
+    show_after = order == 'post' and not leaves_only
+    keys = []
+    prefix = ()
+    stack = [(None, None, iter(dict.items(t)))]
+    while stack:
+        for k, v in stack[-1][2]:
+            branch = isinstance(v, dict) and v
+            if not branch or show_branches:
+                if not paths:
+                    yield k, v
+                else:
+                    if prefix is None: prefix = tuple(keys)
+                    yield prefix + (k,), v
+            if branch:
+                keys.append(k)
+                stack.append((k, v, iter(dict.items(v))))
+                prefix = None
+                break
+        else:
+            k, v, _ = stack.pop()
+            if not stack: break
+            if show_after: yield (tuple(keys) if paths else k), v
+            keys.pop()
+            prefix = None
 
 
 class SloppyDict(dict):
@@ -112,18 +209,340 @@ class SloppyDict(dict):
 
 
 class SloppyTree: pass
+class FrozenSloppyTree: pass
+class TreeDiff: pass
+class TreeView: pass
+
+def count_tree(t:dict) -> Tuple[int, int, bool]:
+    """
+    Count the nodes of t as SloppyTree.__len__ does, and its leaves as
+    SloppyTree.__invert__ does: each key and each value that is not a 
+    dict is a node, and each value that is not a dict, or is an empty 
+    dict, is a leaf. The counts of the SloppyTrees along the way are
+    kept, unless they contain a plain dict.
+
+    returns -- nodes, leaves, and False if a plain dict was found (and
+        the counts cannot be kept).
+    """
+    # Each frame is [dict, iterator over its values, nodes, leaves, keep]
+    stack = [[t, iter(dict.values(t)), 0, 0, isinstance(t, SloppyTree)]]
+    while True:
+        frame = stack[-1]
+        for v in frame[1]:
+            if not isinstance(v, dict):
+                frame[2] += 2
+                frame[3] += 1
+            elif isinstance(v, SloppyTree) and v._nodes >= 0:
+                frame[2] += 1 + v._nodes
+                frame[3] += v._leaves if v._nodes else 1
+            else:
+                stack.append([v, iter(dict.values(v)), 0, 0, isinstance(v, SloppyTree)])
+                break
+        else:
+            d, _, nodes, leaves, keep = stack.pop()
+            if keep:
+                set_leaves(d, leaves)
+                set_nodes(d, nodes)
+            if not stack: return nodes, leaves, keep
+
+            frame = stack[-1]
+            frame[2] += 1 + nodes
+            frame[3] += leaves if nodes else 1
+            frame[4] = frame[4] and keep
+
+
+###
+# The collector is process-wide, so the pauses of all threads are 
+# counted together, and it runs again only after the last one ends.
+###
+pauses = 0
+pause_lock = threading.Lock()
+was_collecting = False
+
+@contextlib.contextmanager
+def collector_paused() -> Iterator[None]:
+    """
+    Keep the cyclic garbage collector from running over a large tree
+    again and again while it is being built or taken apart:
+
+        with collector_paused():
+            t = SloppyTree.from_paths(pairs)
+
+    It is safe to nest, and to use from several threads at once.
+    """
+    global pauses, was_collecting
+    with pause_lock:
+        if not pauses:
+            was_collecting = gc.isenabled()
+            gc.disable()
+        pauses += 1
+    try:
+        yield
+    finally:
+        with pause_lock:
+            pauses -= 1
+            if not pauses and was_collecting: gc.enable()
+
+
+def counted(v:object) -> Optional[Tuple[int, int]]:
+    """
+    What v adds to the counts of the tree that contains it, or None
+    if that is not known.
+    """
+    if isinstance(v, SloppyTree):
+        n = v._nodes
+        return None if n < 0 else (1 + n, v._leaves if n else 1)
+    return None if isinstance(v, dict) else (2, 1)
+
+
+class Missing:
+    """
+    The value of a key that is not there, where None would be 
+    ambiguous. Looking anything up in missing gives missing, so that
+    a chain of lookups through a TreeView ends in missing at the first
+    key that is not there.
+    """
+    __slots__ = ()
+
+    def __getattr__(self, k:str) -> object:
+        if k.startswith('_'):
+            raise AttributeError(f"No element named {k}")
+        return self
+
+    def __getitem__(self, k:Hashable) -> object:
+        return self
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __repr__(self) -> str:
+        return 'missing'
+
+    def __reduce__(self) -> str:
+        return 'missing'
+
+missing = Missing()
+
+
+def leaf_dtype(values:Iterable) -> object:
+    """
+    The numpy dtype for gather() to use for values.
+    """
+    kinds = {type(_) for _ in values}
+    if kinds == {bool}: return numpy.bool_
+    if kinds <= {int}: return numpy.int64
+    if kinds <= {int, float}: return numpy.float64
+    if kinds == {str}: return str
+    return object
+
+
+###
+# Glob queries. A pattern is a dotted string, or a tuple of keys, in
+# which * matches any one key, ** matches any number of keys (including
+# none), and a key containing *, ?, or [ is matched with fnmatch.
+# Keys that are not strings match their str() as well as themselves.
+###
+indexed = 0
+
+class Glob:
+    """
+    A pattern, compiled. Matching works on positions in the pattern:
+    after each key of a path, the positions that could have been 
+    reached. Without ** there is only ever one.
+    """
+    __slots__ = ('parts', 'tests', 'deep', 'memo')
+
+    def __init__(self, pattern:Union[str, tuple]):
+        self.parts = tuple(pattern.split('.')) if isinstance(pattern, str) else tuple(pattern)
+        self.tests = tuple(Glob.test(_) for _ in self.parts)
+        self.deep = '**' in self.parts
+        self.memo = {}
+
+
+    @staticmethod
+    def test(part:object) -> Optional[Callable]:
+        """
+        A function that matches a key against part, or None if part
+        matches any key.
+        """
+        if part in ('*', '**'): return None
+        if isinstance(part, str) and any(c in part for c in '*?['):
+            match = re.compile(fnmatch.translate(part)).match
+            return lambda k: match(str(k)) is not None
+        return lambda k: k == part or type(k) is not str and str(k) == part
+
+
+    def literal(self, i:int) -> tuple:
+        """
+        If the ith part is a plain key, the keys it could be; else ().
+        """
+        part = self.parts[i]
+        if part in ('*', '**') or isinstance(part, str) and any(c in part for c in '*?['):
+            return ()
+        return (part, int(part)) if isinstance(part, str) and part.isdigit() else (part,)
+
+
+    def start(self) -> frozenset:
+        return self.skip_stars((0,))
+
+
+    def skip_stars(self, states:Iterable) -> frozenset:
+        states = set(states)
+        for i in sorted(states):
+            while i < len(self.parts) and self.parts[i] == '**':
+                i += 1
+                states.add(i)
+        return frozenset(states)
+
+
+    def advance(self, states:frozenset, k:Hashable) -> frozenset:
+        """
+        The positions reached by matching key k from each of the 
+        positions in states. A ** stays where it is as it absorbs 
+        keys, and is also skipped over, because it can match nothing.
+        """
+        try:
+            return self.memo[states, k]
+        except KeyError as e:
+            pass
+
+        reached = set()
+        for i in states:
+            if i == len(self.parts): continue
+            if self.parts[i] == '**':
+                reached.add(i)
+            elif self.tests[i] is None or self.tests[i](k):
+                reached.add(i + 1)
+        reached = self.memo[states, k] = self.skip_stars(reached)
+        return reached
+
+
+    def matches(self, path:tuple) -> bool:
+        if not self.deep:
+            return len(path) == len(self.parts) and all(
+                test is None or test(k) for test, k in zip(self.tests, path))
+
+        if all(_ == '**' for _ in self.parts[:-1]):
+            test = self.tests[-1]
+            return test is None or test(path[-1])
+
+        states = self.start()
+        for k in path:
+            states = self.advance(states, k)
+            if not states: return False
+        return len(self.parts) in states
+
+
+class PathIndex:
+    """
+    Every path in a tree, and its value, with the paths also filed by
+    their last key, so that a query such as **.gpus looks only at 
+    the paths that end in gpus. The paths of each SloppyTree within
+    the tree are kept by its id, so that a change to a subtree finds
+    its place in the index without searching for it. Built by 
+    SloppyTree.index(), and kept up to date as the tree changes.
+    """
+    __slots__ = ('paths', 'by_key', 'places')
+
+    def __init__(self, t:dict):
+        self.paths = {}
+        self.by_key = collections.defaultdict(dict)
+        self.places = collections.defaultdict(set)
+        self.add((), t)
+
+
+    def add(self, prefix:tuple, v:object) -> None:
+        """
+        Add prefix (unless it is the root) and everything below it.
+        """
+        if prefix: self._file(prefix, v)
+        if isinstance(v, dict):
+            for path, value in walk(v, paths=True):
+                self._file(prefix + path, value)
+
+
+    def _file(self, path:tuple, v:object) -> None:
+        self.paths[path] = v
+        self.by_key[str(path[-1])][path] = None
+        if isinstance(v, SloppyTree): self.places[id(v)].add(path)
+
+
+    def remove(self, prefix:tuple, v:object) -> None:
+        """
+        Remove prefix, whose value was v, and everything below it.
+        """
+        for path in itertools.chain((prefix,), (prefix + p for p, _ in 
+                walk(v, paths=True)) if isinstance(v, dict) else ()):
+            value = self.paths.pop(path, None)
+            self.by_key[str(path[-1])].pop(path, None)
+            if isinstance(value, SloppyTree):
+                places = self.places[id(value)]
+                places.discard(path)
+                if not places: del self.places[id(value)]
+
+
+    def query(self, glob:Glob) -> Dict[tuple, object]:
+        keys = glob.literal(len(glob.parts) - 1)
+        if keys:
+            candidates = itertools.chain.from_iterable(
+                self.by_key.get(str(k), ()) for k in keys[:1])
+        else:
+            candidates = self.paths
+        return { path: self.paths[path] for path in candidates if glob.matches(path) }
+
+
 class SloppyTree(dict):
     """
     Like SloppyDict() only worse -- much worse.
+
+    The first len() or ~ counts the tree, and each node keeps the
+    counts of the tree below it. After that, a change to a node is
+    added to its counts and to those of the trees that contain it,
+    which is why each node knows its parents. (As a consequence, a 
+    subtree keeps the trees it belongs to alive, and a tree cannot be
+    placed inside itself.) Until it is counted, a tree is built at 
+    full speed. Plain dicts within the tree cannot report their 
+    changes, so a tree that contains them is counted each time.
     """
+    __slots__ = ('_parent', '_nodes', '_leaves', '_index')
+
+    def __init__(self, *args, **kwargs):
+        set_parent(self, None)
+        set_nodes(self, -1)
+        set_leaves(self, -1)
+        set_index(self, None)
+        if not args and not kwargs: return
+
+        super().__init__(*args, **kwargs)
+        for v in dict.values(self):
+            if isinstance(v, SloppyTree): v._adopt(self)
+
+
     def __getattr__(self, k:str) -> object:
         """
         Retrieve the element, or implicity call the over-ridden 
         __missing__ method, and make a new one.
+
+        A slot is found here only if it has not been set, which happens
+        when pickle makes the tree without calling __init__, as it does
+        for the trees pickled before there were slots. See unpickled().
         """
+        if k in SloppyTree.__slots__:
+            unpickled(self)
+            return object.__getattribute__(self, k)
+        if k.startswith('__'):
+            raise AttributeError(f"No element named {k}")
         return self[k]
 
 
+    def __setstate__(self, state:object) -> None:
+        """
+        Trees pickled before there were slots carry their (empty) 
+        __dict__ as their state. There is nothing in it to keep.
+        """
+        pass
+
+
     def __setitem__(self, k:str, v:object) -> None:
         """
         Sets the value to the key, or iterated key. This syntax:
@@ -137,7 +556,20 @@ class SloppyTree(dict):
         
         # Typical case, k is the key we want.
         if isinstance(k, (str, int)):
-            super().__setitem__(k, v)
+            old = dict.get(self, k)
+            if old is not v:
+                if isinstance(v, SloppyTree): 
+                    (v or v is self) and self._check_cycle(v)
+                    v._adopt(self)
+                if isinstance(old, SloppyTree): old._orphan(self)
+            if self._nodes < 0:
+                super().__setitem__(k, v)
+            else:
+                before = counted(old) if k in self else (0, 0)
+                super().__setitem__(k, v)
+                isinstance(v, SloppyTree) and v._count()
+                self._recount(before, counted(v))
+            if indexed: self._reindex(k, old, v)
             return
 
         elif isinstance(k, (list, tuple)): 
@@ -159,6 +591,12 @@ class SloppyTree(dict):
 
         t("a.b.c") means t[a][b][c]
         """
+        if self._index is not None:
+            try:
+                return self._index.paths[tuple(key_as_str.split('.'))]
+            except KeyError as e:
+                pass
+
         ptr = self
         for k in key_as_str.split('.'):
             if k not in ptr:
@@ -197,6 +635,14 @@ class SloppyTree(dict):
         if k in self: del self[k]
 
 
+    def __delitem__(self, k:Hashable) -> None:
+        v = dict.__getitem__(self, k)
+        super().__delitem__(k)
+        if isinstance(v, SloppyTree): v._orphan(self)
+        if self._nodes >= 0: self._recount(counted(v), (0, 0))
+        if indexed: self._reindex(k, v, None)
+
+
     def __ilshift__(self, keys:Union[list, tuple]) -> SloppyTree:
         """
         Create a large number of sibling keys from a list.
@@ -211,7 +657,12 @@ class SloppyTree(dict):
         return the number of paths from the root node to the leaves,
         ignoring the nodes along the way.
         """
-        return sum(1 for _ in (i for i in self.leaves()))
+        return self._count()[1]
+
+
+    def __ior__(self, other:Mapping) -> SloppyTree:
+        self.update(other)
+        return self
 
 
     def __iter__(self) -> object:
@@ -219,7 +670,7 @@ class SloppyTree(dict):
         NOTE: dict.__iter__ only sees keys, but SloppyTree.__iter__
         also sees the leaves.
         """
-        return self.traverse
+        return self.traverse()
 
 
     def __bool__(self) -> bool:
@@ -235,7 +686,7 @@ class SloppyTree(dict):
         """
         return the number of nodes/branches.
         """
-        return sum(1 for _ in (i for i in self.traverse(False)))
+        return self._count()[0]
 
 
     def __missing__(self, k:str) -> object:
@@ -250,25 +701,205 @@ class SloppyTree(dict):
     def __str__(self) -> str:
         return self.printable
 
+    def __reduce_ex__(self, protocol:int) -> tuple:
+        """
+        Pickle (and deepcopy) the contents, not the parents and counts.
+        The tree is taken apart into three flat lists, see rebuild_tree(),
+        so that neither pickling nor unpickling recurses, and unpickling
+        does not go through __setitem__. Under protocol 5, the leaves
+        that are bytes or bytearrays (or numpy arrays) can be sent 
+        out-of-band, through pickle's buffer_callback.
+
+        NOTE: a subtree that is in the tree at two places comes back
+        as two copies. Subtrees of another class are pickled as values.
+        """
+        cls = type(self)
+        out_of_band = protocol >= 5
+        shape = array.array('i', (dict.__len__(self),))
+        keys, values = [], []
+        add_shape, add_key, add_value = shape.append, keys.append, values.append
+        stack = [iter(dict.items(self))]
+        while stack:
+            for k, v in stack[-1]:
+                add_key(k)
+                if type(v) is cls:
+                    add_shape(dict.__len__(v))
+                    stack.append(iter(dict.items(v)))
+                    break
+                add_shape(-1)
+                if out_of_band and isinstance(v, (bytes, bytearray)): 
+                    v = BufferLeaf(v)
+                add_value(v)
+            else:
+                stack.pop()
+        return (rebuild_tree, (cls, shape, keys, values))
+
+
+    def __copy__(self) -> SloppyTree:
+        """
+        A new top node that shares the subtrees of this one.
+        """
+        return self.__class__(dict.items(self))
+
+    ###
+    # The dict methods that change the contents without going through
+    # __setitem__ and __delitem__.
+    ###
+    def clear(self) -> None:
+        items = list(dict.items(self)) if indexed else ()
+        for v in dict.values(self):
+            if isinstance(v, SloppyTree): v._orphan(self)
+        super().clear()
+        if self._nodes >= 0: self._recount((self._nodes, self._leaves), (0, 0))
+        for k, v in items:
+            self._reindex(k, v, None)
+
+
+    def pop(self, k:Hashable, *default) -> object:
+        if k not in self: return super().pop(k, *default)
+        v = dict.__getitem__(self, k)
+        del self[k]
+        return v
+
+
+    def popitem(self) -> tuple:
+        k, v = super().popitem()
+        if isinstance(v, SloppyTree): v._orphan(self)
+        if self._nodes >= 0: self._recount(counted(v), (0, 0))
+        if indexed: self._reindex(k, v, None)
+        return k, v
+
+
+    def setdefault(self, k:Hashable, default:object=None) -> object:
+        if k not in self: self[k] = default
+        return dict.__getitem__(self, k)
+
+
+    def update(self, *args, **kwargs) -> None:
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
     ###
-    # All objects derived from dict need these functions if they
-    # are to be pickled or otherwise examined internally.
+    # Bookkeeping for len() and ~
     ###
-    def __getstate__(self): return self.__dict__
+    def _adopt(self, parent:SloppyTree) -> None:
+        """
+        Note that parent now contains this tree. _parent is a tuple
+        only when the tree has been placed in more than one spot.
+        """
+        p = self._parent
+        object.__setattr__(self, '_parent', parent if p is None else
+            (p + (parent,) if isinstance(p, tuple) else (p, parent)))
 
-    def __setstate__(self, d): self.__dict__.update(d)
+
+    def _orphan(self, parent:SloppyTree) -> None:
+        """
+        Note that parent no longer contains this tree.
+        """
+        p = self._parent
+        if isinstance(p, tuple):
+            i = next(i for i, _ in enumerate(p) if _ is parent)
+            p = p[:i] + p[i+1:]
+            p = p[0] if len(p) == 1 else p
+        else:
+            p = None
+        object.__setattr__(self, '_parent', p)
+
+
+    def _reindex(self, k:Hashable, old:object, new:object) -> None:
+        """
+        Key k of this tree has changed from old to new (either may be
+        None, meaning absent). Bring the index of each tree at or above
+        this one up to date. Each index knows where this tree is within
+        its own tree, so the climb only has to find the indexes.
+        """
+        tops, seen, stack = [], set(), [self]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen: continue
+            seen.add(id(node))
+            if node._index is not None: tops.append(node)
+            p = node._parent
+            if p is not None: stack.extend(p) if isinstance(p, tuple) else stack.append(p)
+
+        for top in tops:
+            index = top._index
+            for place in ((),) if top is self else tuple(index.places.get(id(self), ())):
+                path = place + (k,)
+                if old is not None: index.remove(path, old)
+                if new is not None: index.add(path, new)
+
+
+    def _check_cycle(self, v:SloppyTree) -> None:
+        """
+        raises ValueError if v contains this tree.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node is v:
+                raise ValueError("A SloppyTree cannot contain itself.")
+            p = node._parent
+            if p is None: continue
+            stack.extend(p) if isinstance(p, tuple) else stack.append(p)
+
+
+    def _recount(self, before:Optional[tuple], after:Optional[tuple]) -> None:
+        """
+        One of the values in this counted tree has gone from adding
+        before to the counts to adding after. Correct the counts here,
+        and then in the trees that contain this one, for as long as 
+        there is a difference. A tree is counted only if the trees 
+        below it are, so the climb also stops at the first tree that
+        has not been counted.
+
+        If after is None, the new value (a plain dict) cannot be kept
+        count of, and the counts are discarded instead.
+        """
+        if after is None:
+            dn = dl = None
+        else:
+            dn, dl = after[0] - before[0], after[1] - before[1]
+
+        stack = [(self, dn, dl)]
+        while stack:
+            node, dn, dl = stack.pop()
+            # The usual case, a chain of single parents, is a loop.
+            while True:
+                n = node._nodes
+                if n < 0: break
+                if dn is None:
+                    set_nodes(node, -1)
+                else:
+                    l = node._leaves
+                    n2, l2 = n + dn, l + dl
+                    set_nodes(node, n2)
+                    set_leaves(node, l2)
+                    dl = (l2 if n2 else 1) - (l if n else 1)
+                    if not dn and not dl: break
+
+                p = node._parent
+                if p is None: break
+                if isinstance(p, tuple):
+                    stack.extend((parent, dn, dl) for parent in p)
+                    break
+                node = p
+
+
+    def _count(self) -> Tuple[int, int, bool]:
+        """
+        returns -- the number of nodes and the number of leaves below
+            this one, and whether the counts could be kept.
+        """
+        if self._nodes >= 0: return self._nodes, self._leaves, True
+        return count_tree(self)
 
     def leaves(self) -> object:
         """
         Walk the leaves only, left to right.
         """ 
-        for k, v in self.items():
-            if isinstance(v, dict):
-                if v=={}:
-                    yield v
-                yield from v.leaves()
-            else:
-                yield v
+        for k, v in walk(self, leaves_only=True):
+            yield v
 
 
     @property
@@ -293,12 +924,10 @@ class SloppyTree(dict):
                 ....
         """
 
-        for k, v in self.items():
-            yield k, 1 if with_indicator else k
-            if isinstance(v, dict):
-                yield from v.traverse(with_indicator)
-            else:
-                yield v, 0 if with_indicator else v
+        for k, v in walk(self):
+            yield (k, 1) if with_indicator else k
+            if not isinstance(v, dict):
+                yield (v, 0) if with_indicator else v
 
 
     def as_tuples(self) -> tuple:
@@ -330,21 +959,404 @@ class SloppyTree(dict):
 
     def tree_as_table(self, nested_dict:SloppyTree=None, prepath=()):
         """
-        Finds the path from the root to each leaf.
+        Finds the path from the root to each leaf. An empty dict 
+        ends a path; otherwise, the leaf's value is the last element.
         """
         if nested_dict is None: nested_dict = self
-        for k, v in nested_dict.items():
-            path = prepath + (k,)
-            #print("the path is here ", path)
-            if isinstance(v, dict): # v is a dict
-                if v=={}:
-                    yield path
-                else:
-                    yield from self.tree_as_table(v, path)
+        for path, v in walk(nested_dict, paths=True, leaves_only=True):
+            if not isinstance(v, dict):
+                yield prepath + path + (v,)
+            elif not v:
+                yield prepath + path
+
+
+    @classmethod
+    def from_paths(cls, pairs:Iterable[Tuple[tuple, object]]) -> SloppyTree:
+        """
+        Build a tree in one pass from (path, value) pairs, such as
+        those from flatten(). A path is a tuple of keys, or a dotted
+        string. An empty dict as the value makes an empty subtree.
+
+        Consecutive paths usually share most of their keys, so the 
+        nodes along the previous path are remembered, and only the 
+        keys after the shared part are looked up. If a key along a 
+        path holds something other than a SloppyTree, that value is
+        replaced by a new subtree. For a large tree, call it within
+        collector_paused().
+        """
+        root = cls()
+        prev = ()
+        chain = [root]
+        node = root
+        fast = not indexed
+        store, lookup = dict.__setitem__, dict.get
+
+        for path, value in pairs:
+            if isinstance(path, str): path = tuple(path.split('.'))
+            if not path: continue
+            prefix = path[:-1]
+
+            # Siblings follow one another, and share the whole prefix.
+            if prefix != prev:
+                # Back up to the part of the previous path that is shared.
+                i, m = 0, min(len(prev), len(prefix))
+                while i < m and prev[i] == prefix[i]: 
+                    i += 1
+                del chain[i+1:]
+
+                node = chain[i]
+                for k in prefix[i:]:
+                    child = lookup(node, k)
+                    if not isinstance(child, SloppyTree):
+                        child = cls()
+                        if fast and node._nodes < 0:
+                            store(node, k, child)
+                            set_parent(child, node)
+                        else:
+                            node[k] = child
+                    chain.append(child)
+                    node = child
+                prev = prefix
+                # The nodes made here have no counts or index to keep 
+                # up to date, but a SloppyTree given as a value might.
+                fast = not indexed and node._nodes < 0
+
+            k = path[-1]
+            if fast and not isinstance(value, dict) and k not in node:
+                store(node, k, value)
+            else:
+                node[k] = cls() if isinstance(value, dict) and not value else value
+
+        return root
+
+
+    @classmethod
+    def from_table(cls, rows:Iterable[tuple]) -> SloppyTree:
+        """
+        Build a tree from the rows of tree_as_table(), reading the 
+        last element of each row as the value. (A row for an empty
+        subtree has no value, so its last key becomes a value.)
+        """
+        return cls.from_paths((row[:-1], row[-1]) for row in rows if len(row) > 1)
+
+
+    def flatten(self) -> Iterable[Tuple[tuple, object]]:
+        """
+        The (path, value) pairs for the leaves, in order, including an
+        empty dict for each empty subtree. from_paths() reverses it.
+        """
+        return walk(self, paths=True, leaves_only=True)
+
+
+    def view(self) -> TreeView:
+        """
+        A read-only TreeView of this tree, in which looking up a key 
+        that is not there gives missing instead of a new subtree.
+        """
+        return TreeView(self)
+
+
+    def prune(self) -> Dict[str, int]:
+        """
+        Remove the empty subtrees below this one, such as those that
+        __missing__ made for lookups of keys that were not there, and
+        then the subtrees that are left empty by their removal. This 
+        tree is kept, even if it ends up empty. 
+
+        NOTE: an empty subtree that was put there on purpose looks 
+        just like one made by a lookup, and it is removed, too.
+
+        returns -- the number of subtrees removed (a subtree that was
+            in two places counts twice), and the bytes that they 
+            occupied, as reported by sys.getsizeof().
+        """
+        removed = size = 0
+        seen, freed = {id(self)}, set()
+        # Each frame is [tree, iterator over its values, and the changes
+        # to its counts from the subtrees pruned below it].
+        stack = [[self, iter(list(dict.values(self))), 0, 0]]
+        while stack:
+            frame = stack[-1]
+            for v in frame[1]:
+                if isinstance(v, SloppyTree) and dict.__len__(v) and id(v) not in seen:
+                    seen.add(id(v))
+                    stack.append([v, iter(list(dict.values(v))), 0, 0])
+                    break
+            else:
+                # Everything below node has been pruned. 
+                node, _, dn, dl = stack.pop()
+                empty = [ k for k, v in dict.items(node) 
+                    if isinstance(v, SloppyTree) and not dict.__len__(v) ]
+                for k in empty:
+                    v = dict.__getitem__(node, k)
+                    if indexed:
+                        del node[k]
+                    else:
+                        dict.__delitem__(node, k)
+                        v._orphan(node)
+                    removed += 1
+                    if id(v) not in freed:
+                        freed.add(id(v))
+                        size += sys.getsizeof(v)
+
+                # __delitem__ has kept the counts, or there are none 
+                # to keep. Otherwise, each empty subtree was one node 
+                # and one leaf, and the counts of node are corrected
+                # for all of them at once, and the difference passed
+                # on to the frame of its parent.
+                n = node._nodes
+                if indexed or n < 0: continue
+                dn, dl = dn - len(empty), dl - len(empty)
+                if not dn and not dl: continue
+                if node is self or isinstance(node._parent, tuple):
+                    node._recount((0, 0), (dn, dl))
+                    continue
+                l = node._leaves
+                n2, l2 = n + dn, l + dl
+                set_nodes(node, n2)
+                set_leaves(node, l2)
+                stack[-1][2] += dn
+                stack[-1][3] += (l2 if n2 else 1) - (l if n else 1)
+
+        return {'subtrees': removed, 'bytes': size}
+
+
+    def freeze(self) -> FrozenSloppyTree:
+        """
+        A FrozenSloppyTree with the same contents. See freeze().
+        """
+        return freeze(self)
+
+
+    def diff(self, other:dict) -> TreeDiff:
+        """
+        How other differs from this tree. See diff().
+        """
+        return diff(self, other)
+
+
+    def to_json(self, f:object=None, default:Callable=None) -> Optional[str]:
+        """
+        Write the tree as JSON to f, a file or file name, a piece at a
+        time; or if f is None, return the JSON. As with json.dump(), the
+        keys become strings, and default(v) is called to convert values
+        that JSON cannot represent.
+        """
+        if f is None:
+            fp = io.StringIO()
+            write_json(self, fp, default)
+            return fp.getvalue()
+
+        with opened(f, 'w') as fp:
+            write_json(self, fp, default)
+
+
+    @classmethod
+    def from_json(cls, f:object) -> SloppyTree:
+        """
+        Read a tree from f, a file, a file name, or a string of JSON
+        (anything starting with '{'). Each object becomes a node as it
+        is read, so there is no need for deepsloppy().
+
+        NOTE: the json module reads recursively, and cannot read trees 
+        that are deeper than the recursion limit. MessagePack can.
+        """
+        if isinstance(f, (str, bytes)) and f.lstrip()[:1] in ('{', b'{'):
+            t = json.loads(f, object_pairs_hook=cls)
+        else:
+            with opened(f, 'r') as fp:
+                t = json.load(fp, object_pairs_hook=cls)
+        if not isinstance(t, cls): raise ValueError("The JSON is not an object.")
+        return t
+
+
+    def to_msgpack(self, f:object=None, default:Callable=None) -> Optional[bytes]:
+        """
+        Write the tree as MessagePack to f, a binary file or a file 
+        name, a piece at a time; or if f is None, return the bytes.
+        Unlike JSON, the keys keep their types, and bytes stay bytes.
+        """
+        if f is None:
+            fp = io.BytesIO()
+            write_msgpack(self, fp, default)
+            return fp.getvalue()
+
+        with opened(f, 'wb') as fp:
+            write_msgpack(self, fp, default)
+
+
+    @classmethod
+    def from_msgpack(cls, f:object) -> SloppyTree:
+        """
+        Read a tree from f, a binary file, a file name, or bytes.
+        """
+        if isinstance(f, (bytes, bytearray, memoryview)):
+            data = f
+        else:
+            with opened(f, 'rb') as fp:
+                data = fp.read()
+
+        if we_have_msgpack:
+            t = msgpack.unpackb(data, raw=False, strict_map_key=False, object_pairs_hook=cls)
+        else:
+            t = read_msgpack(data, cls)
+        if not isinstance(t, cls): raise ValueError("The MessagePack data are not a map.")
+        return t
+
+
+    def index(self) -> PathIndex:
+        """
+        Build an index of every path in the tree, which query() and 
+        t("a.b.c") will use, and which is kept up to date as the tree
+        changes. While any tree has an index, changes to every tree 
+        cost a little more, so drop_index() when it is no longer 
+        needed.
+        """
+        global indexed
+        if self._index is None:
+            object.__setattr__(self, '_index', PathIndex(self))
+            indexed += 1
+        return self._index
+
+
+    def drop_index(self) -> None:
+        global indexed
+        if self._index is not None:
+            object.__setattr__(self, '_index', None)
+            indexed -= 1
+
+
+    def query(self, pattern:Union[str, tuple]) -> Dict[tuple, object]:
+        """
+        Find the paths that match a glob pattern, without creating 
+        anything.
+
+            t.query('partitions.*.ram')  -- the ram of each partition
+            t.query('**.gpus')           -- every gpus, at any depth
+            t.query('*.node0[0-4]*')     
+
+        The pattern is a dotted string, or a tuple of keys (for keys 
+        that contain dots, or are not strings). See Glob.
+
+        returns -- {path: value} in the order of the tree. If there is
+            an index, the paths added since it was built come last.
+        """
+        glob = Glob(pattern)
+        if not glob.parts: return {}
+        # Without **, looking up the keys level by level reads less
+        # than the index would.
+        if self._index is not None and glob.deep: return self._index.query(glob)
+        if not glob.deep: return dict(self._find(glob))
+
+        found = {}
+        end = len(glob.parts)
+        stack = [((), iter(dict.items(self)), glob.start())]
+        while stack:
+            prefix, kids, states = stack[-1]
+            for k, v in kids:
+                reached = glob.advance(states, k)
+                if not reached: continue
+                path = prefix + (k,)
+                if end in reached: found[path] = v
+                # Go down only if there is more of the pattern to match.
+                if isinstance(v, dict) and v and reached != {end}:
+                    stack.append((path, iter(dict.items(v)), reached))
+                    break
+            else:
+                stack.pop()
+        return found
+
+
+    def _find(self, glob:Glob) -> List[Tuple[tuple, object]]:
+        """
+        The (path, value) pairs that match a pattern without **, found
+        one level at a time, looking up the plain keys rather than 
+        reading every key.
+        """
+        get, items = dict.get, dict.items
+        level = [((), self)]
+        for i, test in enumerate(glob.tests):
+            keys = glob.literal(i)
+            nodes = [ _ for _ in level if isinstance(_[1], dict) ]
+            if len(keys) == 1:
+                k = keys[0]
+                level = [ (prefix + (k,), v) for prefix, v in 
+                    ((prefix, get(d, k, missing)) for prefix, d in nodes) if v is not missing ]
+            elif keys:
+                level = [ (prefix + (k,), dict.__getitem__(d, k)) 
+                    for prefix, d in nodes for k in keys if dict.__contains__(d, k) ]
+            elif test is None:
+                level = [ (prefix + (k,), v) for prefix, d in nodes for k, v in items(d) ]
             else:
-                #### append the value of the leaf based on the key here
-                path=path+(nested_dict.get(k), )
-                yield path
+                level = [ (prefix + (k,), v) for prefix, d in nodes for k, v in items(d) if test(k) ]
+        return level
+
+
+    def walk(self, order:str='pre', paths:bool=False, 
+            leaves_only:bool=False) -> Iterable[Tuple[object, object]]:
+        """
+        See walk() above.
+        """
+        return walk(self, order, paths, leaves_only)
+
+
+    def gather(self, pattern:Union[str, tuple], dtype:object=None) -> Tuple[object, List[tuple]]:
+        """
+        The values at the paths that match pattern (see query()), as a 
+        numpy array, and the paths, in the same order.
+
+            cores, paths = t.gather('partitions.*.*.cores')
+            cores.sum()
+
+        dtype -- the type of the array. If None, it is bool, int64, or
+            float64 if every value is a bool, an int, or a number; str
+            if every value is a str; and otherwise object.
+        """
+        if not we_have_numpy:
+            raise Exception('gather requires numpy.')
+
+        # The pairs, rather than query()'s dict, which would hash
+        # each path.
+        glob = Glob(pattern)
+        found = (self._find(glob) if glob.parts and not glob.deep 
+            else list(self.query(pattern).items()))
+        paths = [ path for path, v in found ]
+        values = [ v for path, v in found ]
+        if dtype is None: dtype = leaf_dtype(values)
+        if dtype is object:
+            array = numpy.empty(len(values), dtype=object)
+            array[:] = values
+            return array, paths
+        return numpy.array(values, dtype=dtype), paths
+
+
+    def scatter(self, paths:Iterable[tuple], values:Iterable, key:Hashable=None) -> None:
+        """
+        The reverse of gather(): set each path to the value in the same
+        place in values, which may be a numpy array. If key is given, it
+        replaces the last key of each path, so that results can be put
+        beside the values they came from:
+
+            cores, paths = t.gather('partitions.*.*.cores')
+            t.scatter(paths, cores / cores.max(), key='share')
+        """
+        if we_have_numpy and isinstance(values, numpy.ndarray):
+            # Python's own numbers, rather than numpy scalars.
+            values = values.tolist()
+        paths = list(paths)
+        values = list(values)
+        if len(paths) != len(values):
+            raise ValueError(f"{len(paths)} paths, but {len(values)} values.")
+
+        # Paths from gather() come in order, so siblings share the
+        # lookup of their parent.
+        above, parent = None, None
+        for path, v in zip(paths, values):
+            if path[:-1] != above:
+                above, parent = path[:-1], self
+                for k in above:
+                    parent = parent[k]
+            parent[path[-1] if key is None else key] = v
 
 
     def dfs(self, start, end, visited, path, v):
@@ -367,6 +1379,1204 @@ class SloppyTree(dict):
                     print("the path: ", path)
 
 
+###
+# A node of a CompactTree changes to a dict when it has more than
+# this many keys. Below it, the nodes share their key layouts.
+###
+shape_limit = 32
+
+###
+# Each Shape remembers at most this many keys that have been added
+# to it only once.
+###
+seen_limit = 64
+
+class Shape: pass
+class Shape:
+    """
+    The keys of a CompactTree node, in order, shared by all the nodes
+    that have the same keys in the same order. Adding a key moves a
+    node to the next Shape, which is created once and then reused.
+
+    The next Shape is created only the second time a key is added to
+    this one. The first time, the node uses a dict, so that keys that
+    do not repeat (a job number, say) do not each make a Shape that is
+    kept for good. At most seen_limit such keys are remembered.
+    """
+    __slots__ = ('keys', 'index', 'transitions', 'seen')
+
+    def __init__(self, keys:tuple=()):
+        self.keys = keys
+        self.index = {k: i for i, k in enumerate(keys)}
+        self.transitions = {}
+        self.seen = None
+
+
+    def add(self, k:Hashable, force:bool=False) -> Optional[Shape]:
+        """
+        The Shape with k added to these keys, or None if k has not
+        been added to them before (and force is False).
+        """
+        try:
+            return self.transitions[k]
+        except KeyError as e:
+            pass
+
+        seen = self.seen
+        if force or seen is not None and k in seen:
+            seen is not None and seen.discard(k)
+            return self.transitions.setdefault(k, Shape(self.keys + (k,)))
+
+        if seen is None or len(seen) >= seen_limit:
+            seen = self.seen = set()
+        seen.add(k)
+        return None
+
+
+empty_shape = Shape()
+
+
+###
+# Direct access to the slots that hold the counts, which is quicker
+# than object.__setattr__().
+###
+set_parent = SloppyTree._parent.__set__
+set_nodes = SloppyTree._nodes.__set__
+set_leaves = SloppyTree._leaves.__set__
+set_index = SloppyTree._index.__set__
+
+
+def has_slots(t:SloppyTree) -> bool:
+    try:
+        object.__getattribute__(t, '_nodes')
+        return True
+    except AttributeError as e:
+        return False
+
+
+def set_slots(t:SloppyTree) -> None:
+    set_parent(t, None)
+    set_nodes(t, -1)
+    set_leaves(t, -1)
+    set_index(t, None)
+
+
+def unpickled(t:SloppyTree) -> None:
+    """
+    Give t, which pickle made without calling __init__, the slots of
+    a new tree. Under protocols 0 and 1, the contents were put in 
+    place by dict.__init__ rather than __setitem__, so the subtrees 
+    below t that are in the same state are set up too, and each is
+    told which tree contains it. (Under the later protocols, t is 
+    still empty here, and __setitem__ does the rest.)
+    """
+    set_slots(t)
+    stack = [t]
+    while stack:
+        node = stack.pop()
+        for v in dict.values(node):
+            if not isinstance(v, SloppyTree): continue
+            if not has_slots(v):
+                set_slots(v)
+                stack.append(v)
+            v._adopt(node)
+
+
+###
+# Read-only views. Each miss is an empty subtree, and a key in its
+# parent, that __missing__ did not have to make.
+###
+empty_tree_bytes = sys.getsizeof(SloppyTree())
+
+class TreeView:
+    """
+    A look at a tree that cannot change it. A key that is not there
+    is a miss, and its value is missing, rather than a new subtree,
+    so that a search of a large tree for things that are not in it
+    does not grow the tree. As missing has every key, 
+
+        t.view().a.b.c 
+
+    is missing if any of a, b, or c is not there. A subtree is seen 
+    through a view of its own, and the views below a view share its 
+    count of the misses.
+    """
+    __slots__ = ('_tree', '_stats')
+
+    def __init__(self, tree:dict, stats:dict=None):
+        object.__setattr__(self, '_tree', tree)
+        object.__setattr__(self, '_stats', {'misses': 0} if stats is None else stats)
+
+
+    def __getattr__(self, k:str) -> object:
+        if k.startswith('_'):
+            raise AttributeError(f"No element named {k}")
+        return self[k]
+
+
+    def __getitem__(self, k:Hashable) -> object:
+        """
+        The value at k, which may be a tuple of keys. Subtrees are
+        returned as views.
+        """
+        v = self._tree
+        for k in (k if isinstance(k, tuple) else (k,)):
+            v = dict.get(v, k, missing) if isinstance(v, dict) else missing
+            if v is missing:
+                self._stats['misses'] += 1
+                return missing
+        return TreeView(v, self._stats) if isinstance(v, dict) else v
+
+
+    def __call__(self, key_as_str:str) -> object:
+        """
+        t("a.b.c") means t.a.b.c
+        """
+        return self[tuple(key_as_str.split('.'))]
+
+
+    def _immutable(self, *args, **kwargs) -> None:
+        raise TypeError("A TreeView cannot be changed.")
+
+    __setattr__ = __delattr__ = __setitem__ = __delitem__ = _immutable
+
+
+    def __contains__(self, k:Hashable) -> bool:
+        return k in self._tree
+
+
+    def __iter__(self) -> Iterator:
+        return iter(dict.keys(self._tree))
+
+
+    def __len__(self) -> int:
+        """
+        The number of keys, as for a dict.
+        """
+        return dict.__len__(self._tree)
+
+
+    def __bool__(self) -> bool:
+        return not not dict.__len__(self._tree)
+
+
+    def __repr__(self) -> str:
+        return f"TreeView({dict.__repr__(self._tree)})"
+
+
+    def get(self, k:Hashable, default:object=None) -> object:
+        v = self[k]
+        return default if v is missing else v
+
+
+    def keys(self) -> Iterable[Hashable]:
+        return dict.keys(self._tree)
+
+
+    def items(self) -> Iterable[Tuple[Hashable, object]]:
+        for k, v in dict.items(self._tree):
+            yield k, TreeView(v, self._stats) if isinstance(v, dict) else v
+
+
+    def values(self) -> Iterable[object]:
+        for k, v in self.items():
+            yield v
+
+
+    def stats(self) -> dict:
+        """
+        The number of misses, and the bytes of the empty subtrees that
+        they would otherwise have added to the tree.
+        """
+        return dict(self._stats, bytes=self._stats['misses'] * empty_tree_bytes)
+
+
+###
+# Serialization. The writers visit the tree with an explicit stack, 
+# as walk() does, and write to the file in chunks, so neither the depth
+# of the tree nor its size in text matters. Lists and tuples are
+# written as arrays, and read back as lists.
+###
+chunk_size = 1 << 16
+
+@contextlib.contextmanager
+def opened(f:object, mode:str) -> object:
+    """
+    f if it is already a file, or else f opened as a file name.
+    """
+    if hasattr(f, 'write' if 'w' in mode else 'read'):
+        yield f
+    else:
+        with open(f, mode) as fp:
+            yield fp
+
+
+json_string = json.encoder.encode_basestring_ascii
+json_specials = {'nan': 'NaN', 'inf': 'Infinity', '-inf': '-Infinity'}
+
+def json_key(k:Hashable) -> str:
+    """
+    A key as json.dump() writes it: always a string.
+    """
+    if isinstance(k, str): return json_string(k) + ':'
+    if k is None or isinstance(k, (int, float)): return json_string(json.dumps(k)) + ':'
+    raise TypeError(f"keys must be str, int, float, bool or None, not {type(k).__name__}")
+
+
+def write_json(t:dict, fp:object, default:Callable=None) -> None:
+    """
+    Write t to the text file fp as compact JSON. default is as for 
+    json.dump(): it is called for values that JSON has no type for.
+    """
+    pieces = []
+    write = fp.write
+    keys = {}
+    stack = [(None, iter((t,)))]
+    first = True
+    while stack:
+        close, items = stack[-1]
+        for item in items:
+            if first: first = False
+            else: pieces.append(',')
+
+            if close == '}':
+                k, v = item
+                try:
+                    pieces.append(keys[k])
+                except (KeyError, TypeError) as e:
+                    key = json_key(k)
+                    if len(keys) < chunk_size: keys[k] = key
+                    pieces.append(key)
+            else:
+                v = item
+
+            kind = type(v)
+            if kind is str:
+                pieces.append(json_string(v))
+            elif kind is int:
+                pieces.append(int.__repr__(v))
+            elif kind is float:
+                v = float.__repr__(v)
+                pieces.append(json_specials.get(v, v))
+            elif isinstance(v, dict):
+                pieces.append('{')
+                stack.append(('}', iter(dict.items(v))))
+                first = True
+                break
+            elif isinstance(v, (list, tuple)):
+                pieces.append('[')
+                stack.append((']', iter(v)))
+                first = True
+                break
+            else:
+                pieces.append(json.dumps(v, default=default))
+
+            if len(pieces) > chunk_size:
+                write(''.join(pieces))
+                pieces.clear()
+        else:
+            stack.pop()
+            if close: pieces.append(close)
+            first = False
+
+    write(''.join(pieces))
+
+
+###
+# MessagePack. If the msgpack package is installed, it does the 
+# packing and unpacking; otherwise these functions read and write the 
+# same format for the types that a tree usually holds: None, bool, 
+# int, float, str, bytes, lists, and dicts. 
+###
+msgpack_numbers = { code: struct.Struct(fmt) for code, fmt in (
+    (0xca, '>f'), (0xcb, '>d'), (0xcc, '>B'), (0xcd, '>H'), (0xce, '>I'), 
+    (0xcf, '>Q'), (0xd0, '>b'), (0xd1, '>h'), (0xd2, '>i'), (0xd3, '>q')) }
+msgpack_sized = { code: (kind, struct.Struct(fmt)) for code, kind, fmt in (
+    (0xc4, 'bin', '>B'), (0xc5, 'bin', '>H'), (0xc6, 'bin', '>I'), 
+    (0xd9, 'str', '>B'), (0xda, 'str', '>H'), (0xdb, 'str', '>I'), 
+    (0xdc, 'array', '>H'), (0xdd, 'array', '>I'), 
+    (0xde, 'map', '>H'), (0xdf, 'map', '>I')) }
+msgpack_constants = {0xc0: None, 0xc2: False, 0xc3: True}
+
+def msgpack_header(n:int, fix:int, code:int) -> bytes:
+    """
+    The header of a map (fix 0x80, code 0xde) or an array (0x90, 0xdc) 
+    with n elements.
+    """
+    if n < 16: return bytes((fix | n,))
+    return struct.pack('>BH', code, n) if n < 1<<16 else struct.pack('>BI', code + 1, n)
+
+
+def msgpack_sized_header(n:int, codes:Tuple[int, int, int]) -> bytes:
+    """
+    The header of a str or bin of n bytes, using the 8, 16, or 32 bit
+    length code.
+    """
+    if n < 1<<8: return struct.pack('>BB', codes[0], n)
+    if n < 1<<16: return struct.pack('>BH', codes[1], n)
+    return struct.pack('>BI', codes[2], n)
+
+
+def msgpack_scalar(v:object, default:Callable=None) -> bytes:
+    """
+    v in MessagePack, if it is not a container.
+    """
+    if v is None: return b'\xc0'
+    if v is True: return b'\xc3'
+    if v is False: return b'\xc2'
+    if isinstance(v, int):
+        if -32 <= v < 128: return struct.pack('>b' if v < 0 else '>B', v)
+        bits = v.bit_length() if v >= 0 else (~v).bit_length() + 1
+        for size, fmt in ((8, 'B'), (16, 'H'), (32, 'I'), (64, 'Q')):
+            if bits <= size: 
+                return (struct.pack('>B' + fmt, 0xcc + size.bit_length() - 4, v) if v >= 0 
+                    else struct.pack('>B' + fmt.lower(), 0xd0 + size.bit_length() - 4, v))
+        raise OverflowError(f"{v} does not fit in 64 bits")
+    if isinstance(v, float): return struct.pack('>Bd', 0xcb, v)
+    if isinstance(v, str):
+        b = v.encode('utf-8')
+        return (bytes((0xa0 | len(b),)) if len(b) < 32 
+            else msgpack_sized_header(len(b), (0xd9, 0xda, 0xdb))) + b
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        b = bytes(v)
+        return msgpack_sized_header(len(b), (0xc4, 0xc5, 0xc6)) + b
+    if default is not None: return msgpack_scalar(default(v))
+    raise TypeError(f"can not serialize {type(v).__name__!r} object")
+
+
+def write_msgpack(t:dict, fp:object, default:Callable=None) -> None:
+    """
+    Write t to the binary file fp as MessagePack.
+    """
+    if we_have_msgpack:
+        packer = msgpack.Packer(use_bin_type=True, default=default)
+        scalar = packer.pack
+        map_header, array_header = packer.pack_map_header, packer.pack_array_header
+    else:
+        scalar = lambda v: msgpack_scalar(v, default)
+        map_header = lambda n: msgpack_header(n, 0x80, 0xde)
+        array_header = lambda n: msgpack_header(n, 0x90, 0xdc)
+
+    buffer = bytearray()
+    stack = [iter((t,))]
+    while stack:
+        for v in stack[-1]:
+            if isinstance(v, dict):
+                buffer += map_header(dict.__len__(v))
+                stack.append(itertools.chain.from_iterable(dict.items(v)))
+                break
+            elif isinstance(v, (list, tuple)):
+                buffer += array_header(len(v))
+                stack.append(iter(v))
+                break
+            buffer += scalar(v)
+            if len(buffer) > chunk_size:
+                fp.write(buffer)
+                buffer.clear()
+        else:
+            stack.pop()
+
+    fp.write(buffer)
+
+
+def read_msgpack(data:bytes, cls:type) -> object:
+    """
+    The first object in data, with its maps made into cls. The 
+    containers are filled in as they are read rather than by recursion,
+    so there is no limit on the depth.
+    """
+    store = dict.__setitem__
+    pos = 0
+    result = []
+    # Each frame is [container, elements still to come, is a map, key].
+    # A map of n pairs has 2n elements, the keys at the even counts.
+    stack = [[result, 1, False, None]]
+    while stack:
+        code = data[pos]
+        pos += 1
+        n = -1
+        if code < 0x80: 
+            v = code
+        elif code >= 0xe0:
+            v = code - 256
+        elif code < 0x90:
+            kind, n = 'map', code & 0x0f
+        elif code < 0xa0:
+            kind, n = 'array', code & 0x0f
+        elif code < 0xc0:
+            v = str(data[pos:pos + (code & 0x1f)], 'utf-8')
+            pos += code & 0x1f
+        elif code in msgpack_constants:
+            v = msgpack_constants[code]
+        elif code in msgpack_numbers:
+            number = msgpack_numbers[code]
+            v, = number.unpack_from(data, pos)
+            pos += number.size
+        elif code in msgpack_sized:
+            kind, size = msgpack_sized[code]
+            length, = size.unpack_from(data, pos)
+            pos += size.size
+            if kind in ('map', 'array'):
+                n = length
+            else:
+                v = data[pos:pos + length]
+                v = str(v, 'utf-8') if kind == 'str' else bytes(v)
+                pos += length
+        else:
+            raise ValueError(f"unsupported MessagePack type 0x{code:02x} at byte {pos - 1}")
+
+        if n > 0:
+            stack.append([cls(), 2*n, True, None] if kind == 'map' else [[], n, False, None])
+            continue
+        elif n == 0:
+            v = cls() if kind == 'map' else []
+
+        # Put v where it belongs, and then each container that v completes.
+        while stack:
+            frame = stack[-1]
+            container, left, is_map, k = frame
+            if not is_map:
+                container.append(v)
+            elif left % 2 == 0:
+                frame[3] = tuple(v) if isinstance(v, list) else v
+            else:
+                store(container, k, v)
+                if isinstance(v, SloppyTree): set_parent(v, container)
+            frame[1] = left = left - 1
+            if left: break
+            stack.pop()
+            v = container
+
+    return result[0]
+
+
+class BufferLeaf:
+    """
+    A bytes or bytearray leaf that pickles as a PickleBuffer, so that
+    it can go out-of-band, and unpickles as the type it was, whatever
+    kind of buffer the loader hands back.
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data:Union[bytes, bytearray]):
+        self.data = data
+
+    def __reduce_ex__(self, protocol:int) -> tuple:
+        return (buffer_leaf, (pickle.PickleBuffer(self.data), type(self.data)))
+
+
+def buffer_leaf(buf:object, kind:type) -> Union[bytes, bytearray]:
+    return buf if type(buf) is kind else kind(buf)
+
+
+def rebuild_tree(cls:type, shape:array.array, keys:list, values:list) -> SloppyTree:
+    """
+    Unpickle what SloppyTree.__reduce_ex__ took apart. shape has the
+    number of keys in the root, and then for each key in keys, -1 if its
+    value is the next of values, or else the number of keys in the 
+    subtree that is its value. A large tree loads more quickly within
+    collector_paused().
+    """
+    store = dict.__setitem__
+    root = node = cls()
+    left = shape[0]
+    stack = []
+    values = iter(values)
+    for k, n in zip(keys, itertools.islice(shape, 1, None)):
+        while not left: 
+            node, left = stack.pop()
+        left -= 1
+        if n < 0:
+            store(node, k, next(values))
+            continue
+        child = cls()
+        store(node, k, child)
+        set_parent(child, node)
+        if n:
+            stack.append((node, left))
+            node, left = child, n
+    return root
+
+
+###
+# Frozen trees. 
+###
+def freeze(o:object) -> object:
+    """
+    A copy of o that cannot be changed: the dicts (including 
+    SloppyTrees) become FrozenSloppyTrees, the lists and tuples become
+    tuples, and the sets become frozensets. A part of o that appears at
+    several places is frozen once, and shared. What is already a 
+    FrozenSloppyTree is used as it is.
+    """
+    def convertible(v:object) -> bool:
+        return isinstance(v, (dict, list, tuple, set)) and not isinstance(v, FrozenSloppyTree)
+
+    if not convertible(o): return o
+
+    # Children first, so that each container is made from its frozen
+    # contents. done maps id() of each original to its frozen copy.
+    done = {}
+    seen = {id(o)}
+    stack = [(o, False)]
+    while stack:
+        x, ready = stack.pop()
+        items = dict.values(x) if isinstance(x, dict) else x
+        if not ready:
+            stack.append((x, True))
+            for v in items:
+                if convertible(v) and id(v) not in seen:
+                    seen.add(id(v))
+                    stack.append((v, False))
+            continue
+
+        frozen = lambda v: done.get(id(v), v)
+        if isinstance(x, dict):
+            done[id(x)] = FrozenSloppyTree.make((k, frozen(v)) for k, v in dict.items(x))
+        elif isinstance(x, set):
+            done[id(x)] = frozenset(frozen(v) for v in x)
+        else:
+            done[id(x)] = tuple(frozen(v) for v in x)
+
+    return done[id(o)]
+
+
+class FrozenSloppyTree(dict):
+    """
+    A SloppyTree that cannot be changed, and so can be hashed, shared
+    between threads, and used as a key. The hash, and the counts for
+    len() and ~, are worked out the first time they are needed and 
+    then kept.
+
+    Reading is as for a SloppyTree, t.a.b.c, t('a.b.c'), etc., except
+    that a missing key is an error rather than a new node, and that
+    iterating over the tree gives its keys, as for a dict. Changing it
+    raises TypeError; instead, set_in() and delete_in() return a new
+    tree that shares every subtree not on the path to the change, so 
+    that a new version costs only the nodes along that path.
+
+        t = SloppyTree(...).freeze()
+        t2 = t.set_in('partitions.p01.state', 'down')
+        t2.partitions.p02 is t.partitions.p02   # True
+    """
+    __slots__ = ('_hash', '_counts')
+
+    # Frozen trees are never indexed; this is for the query() that
+    # they share with SloppyTree.
+    _index = None
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        for k, v in dict.items(self):
+            if isinstance(v, (dict, list, tuple, set)): dict.__setitem__(self, k, freeze(v))
+        set_hash(self, None)
+        set_counts(self, None)
+
+
+    @classmethod
+    def make(cls, items:Iterable[tuple]) -> FrozenSloppyTree:
+        """
+        A tree of items whose values are already frozen.
+        """
+        t = dict.__new__(cls)
+        dict.update(t, items)
+        set_hash(t, None)
+        set_counts(t, None)
+        return t
+
+
+    def __getattr__(self, k:str) -> object:
+        if k.startswith('__') or k in FrozenSloppyTree.__slots__:
+            raise AttributeError(f"No element named {k}")
+        try:
+            return dict.__getitem__(self, k)
+        except KeyError as e:
+            raise AttributeError(f"No element named {k}") from None
+
+
+    def __call__(self, key_as_str:str) -> object:
+        """
+        t("a.b.c") means t.a.b.c
+        """
+        ptr = self
+        for k in key_as_str.split('.'):
+            if not isinstance(ptr, dict) or k not in ptr:
+                raise AttributeError(f"{k=} not found in sub-tree {ptr=}")
+            ptr = ptr[k]
+        return ptr
+
+
+    def _immutable(self, *args, **kwargs) -> None:
+        raise TypeError(f"A {type(self).__name__} cannot be changed. Use set_in(), delete_in(), or thaw().")
+
+    __setitem__ = __delitem__ = __setattr__ = __delattr__ = _immutable
+    clear = pop = popitem = setdefault = update = __ior__ = _immutable
+
+
+    def __hash__(self) -> int:
+        """
+        The hash of the (key, value) pairs, ignoring their order as
+        == does. Every value must be hashable.
+        """
+        h = self._hash
+        if h is not None: return h
+
+        # Hash the subtrees first, so that the hash of a deep tree 
+        # does not recurse.
+        stack = [(self, False)]
+        while stack:
+            node, ready = stack.pop()
+            if node._hash is not None: continue
+            if ready:
+                set_hash(node, hash(frozenset(dict.items(node))))
+                continue
+            stack.append((node, True))
+            stack.extend((v, False) for v in dict.values(node) 
+                if isinstance(v, FrozenSloppyTree) and v._hash is None)
+        return self._hash
+
+
+    def __eq__(self, other:object) -> bool:
+        """
+        Trees with different hashes (if both are known) are different,
+        and shared subtrees are the same, without looking further. Two
+        frozen trees are compared without recursion.
+        """
+        if not isinstance(other, FrozenSloppyTree): return dict.__eq__(self, other)
+
+        stack = [(self, other)]
+        while stack:
+            a, b = stack.pop()
+            if a is b: continue
+            if a._hash is not None and b._hash is not None and a._hash != b._hash: return False
+            if dict.__len__(a) != dict.__len__(b): return False
+            for k, v in dict.items(a):
+                w = dict.get(b, k, missing)
+                if v is w: continue
+                if isinstance(v, FrozenSloppyTree) and isinstance(w, FrozenSloppyTree):
+                    stack.append((v, w))
+                elif w is missing or not v == w:
+                    return False
+        return True
+
+
+    def __ne__(self, other:object) -> bool:
+        return not self == other
+
+
+    def __len__(self) -> int:
+        """
+        The number of nodes, as for a SloppyTree.
+        """
+        return self._count()[0]
+
+
+    def __invert__(self) -> int:
+        """
+        The number of leaves, as for a SloppyTree.
+        """
+        return self._count()[1]
+
+
+    def __bool__(self) -> bool:
+        return dict.__len__(self) > 0
+
+
+    def __reduce__(self) -> tuple:
+        return (self.__class__, (dict(self),))
+
+
+    def __copy__(self) -> FrozenSloppyTree:
+        return self
+
+
+    def __str__(self) -> str:
+        return self.printable
+
+
+    def _count(self) -> Tuple[int, int]:
+        """
+        The counts of nodes and leaves, worked out as count_tree() does,
+        and kept in each subtree.
+        """
+        counts = self._counts
+        if counts is not None: return counts
+
+        stack = [(self, False)]
+        while stack:
+            node, ready = stack.pop()
+            if node._counts is not None: continue
+            if not ready:
+                stack.append((node, True))
+                stack.extend((v, False) for v in dict.values(node) 
+                    if isinstance(v, FrozenSloppyTree) and v._counts is None)
+                continue
+
+            nodes = leaves = 0
+            for v in dict.values(node):
+                if isinstance(v, FrozenSloppyTree):
+                    n, l = v._counts
+                    nodes += 1 + n
+                    leaves += l if n else 1
+                elif isinstance(v, dict):
+                    n, l, _ = count_tree(v)
+                    nodes += 1 + n
+                    leaves += l if n else 1
+                else:
+                    nodes += 2
+                    leaves += 1
+            set_counts(node, (nodes, leaves))
+        return self._counts
+
+
+    def get_in(self, path:Union[str, tuple], default:object=None) -> object:
+        """
+        The value at path, a dotted string or a tuple of keys, or 
+        default if there is none.
+        """
+        node = self
+        for k in (path.split('.') if isinstance(path, str) else path):
+            if not isinstance(node, dict) or k not in node: return default
+            node = dict.__getitem__(node, k)
+        return node
+
+
+    def _path_to(self, path:tuple) -> List[Optional[dict]]:
+        """
+        The nodes along path, from the root to the parent of its last
+        key, with None for those that do not exist.
+        """
+        nodes = []
+        node = self
+        for k in path[:-1]:
+            nodes.append(node)
+            node = dict.get(node, k) if node is not None else None
+            if not isinstance(node, FrozenSloppyTree): node = None
+        nodes.append(node)
+        return nodes
+
+
+    def _rebuild(self, nodes:list, path:tuple, new:object) -> FrozenSloppyTree:
+        """
+        Copy the nodes along path, from the bottom up, so that the 
+        last key holds new. If new is the missing object, the last key
+        is removed instead.
+        """
+        cls = type(self)
+        for node, k in zip(reversed(nodes), reversed(path)):
+            items = dict(node) if node is not None else {}
+            if new is missing:
+                del items[k]
+            else:
+                items[k] = new
+            new = cls.make(items)
+        return new
+
+
+    def set_in(self, path:Union[str, tuple], value:object) -> FrozenSloppyTree:
+        """
+        A new tree, the same as this one except that path (a dotted
+        string or a tuple of keys) has the value, frozen. The nodes 
+        along the path are created if need be. If the value is already
+        there, the result is this tree.
+        """
+        path = tuple(path.split('.')) if isinstance(path, str) else tuple(path)
+        if not path: raise KeyError("The path is empty.")
+        value = freeze(value)
+        nodes = self._path_to(path)
+        parent = nodes[-1]
+        if parent is not None and dict.get(parent, path[-1], missing) is value: return self
+        return self._rebuild(nodes, path, value)
+
+
+    def delete_in(self, path:Union[str, tuple]) -> FrozenSloppyTree:
+        """
+        A new tree without path, which must exist.
+
+        raises -- KeyError if it does not.
+        """
+        path = tuple(path.split('.')) if isinstance(path, str) else tuple(path)
+        if not path: raise KeyError("The path is empty.")
+        nodes = self._path_to(path)
+        if nodes[-1] is None or path[-1] not in nodes[-1]: raise KeyError(path)
+        return self._rebuild(nodes, path, missing)
+
+
+    def thaw(self) -> SloppyTree:
+        """
+        A SloppyTree with the same contents. The tuples made by freeze()
+        stay tuples. Subtrees shared in this tree are copied separately,
+        because a SloppyTree's nodes can change.
+        """
+        store = dict.__setitem__
+        root = SloppyTree()
+        stack = [(self, root)]
+        while stack:
+            frozen, node = stack.pop()
+            for k, v in dict.items(frozen):
+                if isinstance(v, FrozenSloppyTree):
+                    child = SloppyTree()
+                    store(node, k, child)
+                    set_parent(child, node)
+                    stack.append((v, child))
+                else:
+                    store(node, k, v)
+        return root
+
+
+    def freeze(self) -> FrozenSloppyTree:
+        return self
+
+    # The parts of SloppyTree that only read.
+    printable = SloppyTree.printable
+    traverse = SloppyTree.traverse
+    leaves = SloppyTree.leaves
+    as_tuples = SloppyTree.as_tuples
+    tree_as_table = SloppyTree.tree_as_table
+    flatten = SloppyTree.flatten
+    query = SloppyTree.query
+    walk = SloppyTree.walk
+    to_json = SloppyTree.to_json
+    to_msgpack = SloppyTree.to_msgpack
+    diff = SloppyTree.diff
+    gather = SloppyTree.gather
+    _find = SloppyTree._find
+
+
+set_hash = FrozenSloppyTree._hash.__set__
+set_counts = FrozenSloppyTree._counts.__set__
+
+
+###
+# Comparing and merging trees.
+###
+class TreeDiff(namedtuple('TreeDiff', 'added removed changed')):
+    """
+    The differences between two trees, a and b, as returned by diff().
+    Each is a dict keyed by path, a tuple of keys:
+
+        added   -- {path: value in b} for the keys only in b.
+        removed -- {path: value in a} for the keys only in a.
+        changed -- {path: (value in a, value in b)} for the keys in both
+            whose values differ, other than two subtrees, which are
+            compared key by key.
+
+    A subtree that was added or removed is reported once, at its top.
+    """
+
+    def __bool__(self) -> bool:
+        """
+        True if there are any differences.
+        """
+        return bool(self.added or self.removed or self.changed)
+
+
+    def changes(self) -> Dict[tuple, object]:
+        """
+        {path: new value} for every difference, with missing as the
+        new value of what was removed.
+        """
+        ops = dict.fromkeys(self.removed, missing)
+        ops.update((path, new) for path, (old, new) in self.changed.items())
+        ops.update(self.added)
+        return ops
+
+
+    def apply(self, t:dict) -> dict:
+        """
+        Make the changes to t. A SloppyTree is changed in place; a
+        FrozenSloppyTree cannot be, so a new version is returned.
+        """
+        return apply_changes(t, self.changes())
+
+
+def apply_changes(t:dict, ops:Dict[tuple, object]) -> dict:
+    """
+    Set each path in ops to its value, or delete it if the value is 
+    missing. 
+    """
+    for path, v in ops.items():
+        if isinstance(t, FrozenSloppyTree):
+            if v is not missing: 
+                t = t.set_in(path, v)
+            elif t.get_in(path, missing) is not missing:
+                t = t.delete_in(path)
+        elif v is not missing:
+            t[path] = v
+        else:
+            node = t
+            for k in path[:-1]:
+                node = dict.get(node, k) if isinstance(node, dict) else None
+            if isinstance(node, dict) and path[-1] in node: del node[path[-1]]
+    return t
+
+
+def diff(a:dict, b:dict) -> TreeDiff:
+    """
+    Walk a and b together, and report how b differs from a. Subtrees
+    that are the same object are skipped without being read, as are 
+    FrozenSloppyTrees whose hashes are known and equal (once == has 
+    confirmed it), so two versions of a frozen tree made by set_in() 
+    are compared in time proportional to the changes. Otherwise, every
+    key is compared.
+    """
+    added, removed, changed = {}, {}, {}
+    stack = [((), a, b)]
+    while stack:
+        prefix, x, y = stack.pop()
+        if x is y: continue
+        if (isinstance(x, FrozenSloppyTree) and isinstance(y, FrozenSloppyTree) 
+                and x._hash is not None and x._hash == y._hash and x == y):
+            continue
+
+        below = []
+        for k, v in dict.items(x):
+            w = dict.get(y, k, missing)
+            if v is w: continue
+            path = prefix + (k,)
+            if w is missing:
+                removed[path] = v
+            elif isinstance(v, dict) and isinstance(w, dict):
+                below.append((path, v, w))
+            elif isinstance(v, dict) or isinstance(w, dict) or not v == w:
+                changed[path] = (v, w)
+        for k, w in dict.items(y):
+            if not dict.__contains__(x, k): added[prefix + (k,)] = w
+        # Reversed, so that the subtrees are compared in order.
+        stack.extend(reversed(below))
+
+    return TreeDiff(added, removed, changed)
+
+
+def merge(base:dict, ours:dict, theirs:dict, 
+        prefer:str='ours') -> Tuple[dict, Dict[tuple, tuple]]:
+    """
+    Three-way merge: the changes made from base to theirs, applied to
+    ours. A change conflicts with ours if ours made a different change
+    at the same path, or at a path above or below it. 
+
+    prefer -- at a conflict, keep 'ours' or take 'theirs'.
+
+    returns -- the merged tree, and {path: (base, ours, theirs)} for 
+        each conflict, with missing for a value that is not there. The
+        merged tree is a new version if ours is a FrozenSloppyTree, or
+        else a copy of ours.
+    """
+    if prefer not in ('ours', 'theirs'): raise ValueError(f"Unknown {prefer=}. Use 'ours' or 'theirs'.")
+
+    mine = diff(base, ours).changes()
+    # Every path that ours changed, and every path above one.
+    touched = set()
+    for path in mine:
+        touched.update(path[:i] for i in range(1, len(path)))
+
+    ops, conflicts = {}, {}
+    for path, v in diff(base, theirs).changes().items():
+        if path in mine:
+            w = mine[path]
+            if w is v or w is not missing and v is not missing and w == v: continue
+        elif not path in touched and not any(path[:i] in mine for i in range(1, len(path))):
+            ops[path] = v
+            continue
+
+        value_in = lambda t: (t.get_in(path, missing) if isinstance(t, FrozenSloppyTree) 
+            else FrozenSloppyTree.get_in(t, path, missing))
+        conflicts[path] = (value_in(base), value_in(ours), v)
+        if prefer == 'theirs': ops[path] = v
+
+    merged = ours if isinstance(ours, FrozenSloppyTree) else copy.deepcopy(ours)
+    return apply_changes(merged, ops), conflicts
+
+
+class CompactTree: pass
+class CompactTree(MutableMapping):
+    """
+    A SloppyTree that takes less memory, for trees with hundreds of
+    thousands of nodes. A node is not a dict. It keeps its values in
+    a tuple, and its keys in a Shape that it shares with every other
+    node having the same keys, so each key is stored once no matter how
+    many nodes have it. A node with more than shape_limit keys (the
+    node names of a cluster, for example), or with keys that no other
+    node has had, uses a dict instead.
+
+    Access is the same as for SloppyTree: t.a.b.c = 6, t[('a','b','c')],
+    t('a.b.c'), and reading a missing key creates an empty node. Dicts
+    assigned into the tree are copied into CompactTree nodes. Use 
+    as_tree() to get a SloppyTree, and CompactTree(t) to go the other
+    way.
+    """
+    __slots__ = ('_shape', '_values')
+
+    def __init__(self, *args, **kwargs):
+        object.__setattr__(self, '_shape', empty_shape)
+        object.__setattr__(self, '_values', ())
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+
+    def __getattr__(self, k:str) -> object:
+        if k.startswith('__') or k in CompactTree.__slots__:
+            raise AttributeError(f"No element named {k}")
+        return self[k]
+
+
+    def __setattr__(self, k:str, v:object) -> None:
+        self[k] = v
+
+
+    def __delattr__(self, k:str) -> None:
+        if k in self: del self[k]
+
+
+    def __getitem__(self, k:Hashable) -> object:
+        if isinstance(k, tuple):
+            node = self
+            for _ in k:
+                node = node[_]
+            return node
+
+        shape = self._shape
+        if shape is None:
+            try:
+                return self._values[k]
+            except KeyError as e:
+                pass
+        else:
+            i = shape.index.get(k)
+            if i is not None: return self._values[i]
+
+        v = self[k] = CompactTree()
+        return v
+
+
+    def __setitem__(self, k:Hashable, v:object) -> None:
+        if isinstance(k, (list, tuple)):
+            if not k: raise KeyError(k)
+            node = self[tuple(k[:-1])] if len(k) > 1 else self
+            node[k[-1]] = v
+            return
+
+        if isinstance(v, Mapping) and not isinstance(v, CompactTree):
+            v = CompactTree(v)
+
+        shape = self._shape
+        if shape is None:
+            self._values[k] = v
+            return
+
+        # A tuple takes less room than a list, and the tuples are
+        # short enough to rebuild on each change.
+        values = self._values
+        i = shape.index.get(k)
+        if i is not None:
+            object.__setattr__(self, '_values', values[:i] + (v,) + values[i+1:])
+            return
+
+        new_shape = shape.add(k) if len(shape.keys) < shape_limit else None
+        if new_shape is not None:
+            object.__setattr__(self, '_shape', new_shape)
+            object.__setattr__(self, '_values', values + (v,))
+        else:
+            values = dict(zip(shape.keys, self._values))
+            values[k] = v
+            object.__setattr__(self, '_shape', None)
+            object.__setattr__(self, '_values', values)
+
+
+    def __delitem__(self, k:Hashable) -> None:
+        shape = self._shape
+        if shape is None:
+            del self._values[k]
+            return
+
+        i = shape.index[k]
+        values = self._values
+        object.__setattr__(self, '_values', values[:i] + values[i+1:])
+        new_shape = empty_shape
+        for key in shape.keys[:i] + shape.keys[i+1:]:
+            new_shape = new_shape.add(key, force=True)
+        object.__setattr__(self, '_shape', new_shape)
+
+
+    def __call__(self, key_as_str:str) -> object:
+        """
+        t("a.b.c") means t.a.b.c, but without creating anything.
+        """
+        ptr = self
+        for k in key_as_str.split('.'):
+            if k not in ptr:
+                raise AttributeError(f"{k=} not found in sub-tree {ptr=}")
+            ptr = ptr[k]
+        return ptr
+
+
+    def __contains__(self, k:Hashable) -> bool:
+        shape = self._shape
+        return k in self._values if shape is None else k in shape.index
+
+
+    def __iter__(self) -> Iterator:
+        shape = self._shape
+        return iter(self._values) if shape is None else iter(shape.keys)
+
+
+    def __len__(self) -> int:
+        """
+        The number of keys in this node, as for a dict.
+        """
+        return len(self._values)
+
+
+    def __reduce__(self) -> tuple:
+        return (self.__class__, (), None, None, iter(self.items()))
+
+
+    def __repr__(self) -> str:
+        return f"CompactTree({self.as_tree()!r})"
+
+
+    def __str__(self) -> str:
+        return self.as_tree().printable
+
+
+    def get(self, k:Hashable, default:object=None) -> object:
+        """
+        As for dict.get(); a missing key is not created.
+        """
+        return self[k] if k in self else default
+
+
+    def setdefault(self, k:Hashable, default:object=None) -> object:
+        """
+        As for dict.setdefault(). (The one from MutableMapping relies
+        on a KeyError that __getitem__ never raises.)
+        """
+        if k not in self: self[k] = default
+        return self[k]
+
+
+    def pop(self, k:Hashable, default:object=missing) -> object:
+        """
+        As for dict.pop(); a missing key is not created.
+        """
+        if k not in self:
+            if default is missing: raise KeyError(k)
+            return default
+        v = self[k]
+        del self[k]
+        return v
+
+
+    def as_tree(self) -> SloppyTree:
+        """
+        A SloppyTree with the same contents.
+        """
+        t = SloppyTree()
+        for k, v in self.items():
+            t[k] = v.as_tree() if isinstance(v, CompactTree) else v
+        return t
+
+
 if __name__ == "__main__":
     t = SloppyTree()
 
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for sqlitedb. Each measurement is written as one line of
+JSON, so that the results of different releases, PRAGMA settings, and
+machines can be collected in a file and compared.
+
+Usage:
+
+    python sqlitebench.py --sizes 10M,100M,1G --dir /scratch/bench -o results.jsonl
+    python sqlitebench.py --sizes 10M --pragma journal_mode=WAL --pragma synchronous=NORMAL
+    python sqlitebench.py --sizes 1G --profile read-heavy
+
+For each size, a database of (roughly) that size is built, and the
+following operations are timed:
+
+    open         -- SQLiteDB() on disc, and with to_RAM.
+    insert       -- single-row execute_SQL, each one committed.
+    executemany  -- executemany_SQL at several chunk sizes.
+    select       -- the table (up to --max-fetch rows) via fetchall, pandas
+                    (if present), stream_SQL, and columns_SQL (if numpy
+                    is present).
+    upsert       -- merge a tenth of the table back into itself.
+    connections  -- num_connections by /proc, and by lsof.
+    close        -- closing a to_RAM database, which writes it back.
+"""
+import typing
+from   typing import *
+
+###
+# Standard imports, starting with os and sys
+###
+min_py = (3, 8)
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import argparse
+import contextlib
+import datetime
+import json
+import platform
+import sqlite3
+import time
+
+###
+# From hpclib
+###
+import sqlitedb
+from   sqlitedb import SQLiteDB
+from   urdecorators import trap
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024, University of Richmond'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = f'gflanagin@richmond.edu'
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+###
+# Global objects
+###
+row_bytes = 100
+byte_units = {'K': 1<<10, 'M': 1<<20, 'G': 1<<30, 'T': 1<<40}
+context = {}
+
+
+def parse_size(s:str) -> int:
+    """
+    10M -> 10485760, and so on.
+    """
+    s = s.strip().upper().rstrip('B')
+    return int(float(s[:-1]) * byte_units[s[-1]]) if s[-1] in byte_units else int(s)
+
+
+def make_row(i:int) -> tuple:
+    """
+    A row of about row_bytes bytes that looks like accounting data.
+    """
+    return (i, f"node{i % 997:04d}", i % 64, (i % 1024) * 1.5, f"job {i:012d} " + "x" * 40)
+
+
+def emit(op:str, seconds:float, rows:int=0, **kwargs) -> None:
+    """
+    Print one result as a line of JSON.
+    """
+    result = dict(context, op=op, seconds=round(seconds, 6), rows=rows,
+        rows_per_sec=round(rows / seconds, 1) if seconds and rows else None, **kwargs)
+    print(json.dumps(result), flush=True)
+
+
+@contextlib.contextmanager
+def stopwatch() -> List[float]:
+    """
+    with stopwatch() as t: ... leaves the elapsed time in t[0].
+    """
+    t = [time.perf_counter()]
+    yield t
+    t[0] = time.perf_counter() - t[0]
+
+
+def build(name:str, size:int, pragmas:dict) -> int:
+    """
+    Create a database of about size bytes, and return the number of rows.
+    """
+    for suffix in ('', '-wal', '-shm'):
+        with contextlib.suppress(FileNotFoundError): os.unlink(name + suffix)
+
+    n = max(size // row_bytes, 1000)
+    db = SQLiteDB(name, use_pandas=False)
+    db.execute_SQL('''CREATE TABLE bench (id INTEGER PRIMARY KEY,
+        node TEXT, cores INTEGER, ram REAL, note TEXT)''')
+    with stopwatch() as t:
+        result = db.executemany_SQL('INSERT INTO bench VALUES (?, ?, ?, ?, ?)',
+            (make_row(i) for i in range(n)), chunk_size=100000,
+            pragmas=dict({'synchronous': 'OFF', 'journal_mode': 'MEMORY'}, **pragmas))
+    emit('build', t[0], result.rows, file_bytes=os.path.getsize(name))
+    db.close()
+    return n
+
+
+@trap
+def sqlitebench_main(myargs:argparse.Namespace) -> int:
+
+    pragmas = dict(p.split('=', 1) for p in myargs.pragma)
+    context.update({
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'sqlitedb': sqlitedb.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'pragmas': pragmas,
+        'profile': myargs.profile
+        })
+    os.makedirs(myargs.dir, exist_ok=True)
+
+    for size in myargs.sizes.split(','):
+        name = os.path.join(myargs.dir, f'bench_{size}.db')
+        context['size'] = size
+        n = build(name, parse_size(size), pragmas)
+        sample = min(n, myargs.sample)
+
+        # open
+        with stopwatch() as t:
+            db = SQLiteDB(name, use_pandas=False, profile=myargs.profile)
+        emit('open', t[0])
+        for k, v in pragmas.items():
+            db.execute_SQL(f'pragma {k} = {v}')
+
+        # insert
+        base = n + 1
+        with stopwatch() as t:
+            for i in range(myargs.inserts):
+                db.execute_SQL('INSERT INTO bench VALUES (?, ?, ?, ?, ?)', *make_row(base + i))
+        emit('insert', t[0], myargs.inserts)
+
+        # executemany
+        db.execute_SQL('CREATE TABLE scratch AS SELECT * FROM bench WHERE 0')
+        for chunk_size in (1000, 10000, 100000):
+            with stopwatch() as t:
+                result = db.executemany_SQL('INSERT INTO scratch VALUES (?, ?, ?, ?, ?)',
+                    (make_row(i) for i in range(sample)), chunk_size=chunk_size)
+            emit('executemany', t[0], result.rows, chunk_size=chunk_size)
+            db.execute_SQL('DELETE FROM scratch')
+        db.execute_SQL('DROP TABLE scratch')
+
+        # select. All methods read the same rows, limited so that 
+        # fetchall does not exhaust memory on the largest databases.
+        SQL = f'SELECT * FROM bench LIMIT {myargs.max_fetch}'
+        with stopwatch() as t:
+            rows = len(db.execute_SQL(SQL))
+        emit('select', t[0], rows, method='fetchall')
+
+        with stopwatch() as t:
+            rows = sum(len(_) for _ in db.stream_SQL(SQL, batches=True, batch_size=10000))
+        emit('select', t[0], rows, method='stream')
+
+        if sqlitedb.we_have_pandas:
+            db.use_pandas = True
+            with stopwatch() as t:
+                rows = len(db.execute_SQL(SQL))
+            emit('select', t[0], rows, method='pandas')
+            db.use_pandas = False
+
+        if sqlitedb.we_have_numpy:
+            with stopwatch() as t:
+                rows = len(db.columns_SQL(SQL)['id'])
+            emit('select', t[0], rows, method='columns')
+
+        # upsert
+        with stopwatch() as t:
+            counts = db.upsert('bench', ['id'],
+                (make_row(i) for i in range(0, 2 * sample, 20)))
+        emit('upsert', t[0], sum(counts.values()), **counts)
+
+        # connections
+        for method, f in (('proc', lambda: sqlitedb.proc_openers(db.name)),
+                ('lsof', db.lsof_connections)):
+            with stopwatch() as t:
+                f()
+            emit('connections', t[0], method=method)
+        db.close()
+
+        # to_RAM open and close
+        with stopwatch() as t:
+            db = SQLiteDB(name, use_pandas=False, to_RAM=True)
+        emit('open', t[0], to_RAM=True)
+        db.execute_SQL('INSERT INTO bench VALUES (?, ?, ?, ?, ?)', *make_row(-1))
+        with stopwatch() as t:
+            db.close()
+        emit('close', t[0], to_RAM=True, file_bytes=os.path.getsize(name))
+
+        if not myargs.keep:
+            os.unlink(name)
+
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+
+    here       = os.getcwd()
+    progname   = os.path.basename(__file__)[:-3]
+
+    parser = argparse.ArgumentParser(prog="sqlitebench",
+        description="Time the common sqlitedb operations, and write the results as JSON lines.")
+
+    parser.add_argument('-d', '--dir', type=str, default=here,
+        help="Directory for the test databases.")
+
+    parser.add_argument('--inserts', type=int, default=1000,
+        help="Number of single-row inserts to time.")
+
+    parser.add_argument('-k', '--keep', action='store_true',
+        help="Keep the test databases.")
+
+    parser.add_argument('--max-fetch', type=int, default=5000000,
+        help="Most rows read by each of the SELECT methods.")
+
+    parser.add_argument('-o', '--output', type=str, default="",
+        help="Output file name")
+
+    parser.add_argument('-p', '--pragma', action='append', default=[],
+        help="A PRAGMA setting, name=value, applied to each connection. May be repeated.")
+
+    parser.add_argument('--profile', type=str, default=None,
+        choices=tuple(sqlitedb.tuning_profiles),
+        help="One of the sqlitedb tuning profiles, applied after opening.")
+
+    parser.add_argument('--sample', type=int, default=200000,
+        help="Number of rows used for executemany and upsert.")
+
+    parser.add_argument('-s', '--sizes', type=str, default="10M",
+        help="Comma separated list of database sizes, e.g., 10M,100M,1G,5G")
+
+    myargs = parser.parse_args()
+
+    try:
+        outfile = sys.stdout if not myargs.output else open(myargs.output, 'a')
+        with contextlib.redirect_stdout(outfile):
+            sys.exit(globals()[f"{progname}_main"](myargs))
+
+    except Exception as e:
+        print(f"Escaped or re-raised exception: {e}")
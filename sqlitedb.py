@@ -20,11 +20,19 @@ __license__ =       'MIT'
 import typing
 from   typing import *
 
+from   collections import deque
+from   collections import namedtuple
+from   collections import OrderedDict
+import contextlib
+import itertools
 import os
 import multiprocessing
+import queue
+import re
 import sqlite3
 import sys
 import tempfile
+import threading
 import time
 
 try:
@@ -33,10 +41,461 @@ try:
 except Exception as e:
     we_have_pandas = False
 
+try:
+    import numpy
+    we_have_numpy = True
+except Exception as e:
+    we_have_numpy = False
+
+try:
+    import pyarrow
+    we_have_arrow = True
+except Exception as e:
+    we_have_arrow = False
+
 from dorunrun import dorunrun
 from urdecorators import trap
 
 
+def column_dtype(decltype:str, sample:object=None) -> object:
+    """
+    Choose a numpy dtype for a result column, following SQLite's 
+    rules for type affinity. If the column has no declared type
+    (an expression, for example), the type of a sample value is used.
+
+    decltype -- the declared type of the column, possibly ''.
+    sample   -- a non-NULL value from the column, or None.
+    """
+    decltype = decltype.upper()
+    if 'INT' in decltype: return numpy.int64
+    if any(_ in decltype for _ in ('CHAR', 'CLOB', 'TEXT', 'BLOB')): return object
+    if decltype: return numpy.float64
+
+    if isinstance(sample, int): return numpy.int64
+    if isinstance(sample, float): return numpy.float64
+    return object
+
+
+def store_column(column:object, n:int, values:tuple) -> object:
+    """
+    Copy values into column[n:], widening the column (int64 to 
+    float64 to object) if SQLite's dynamic typing hands us something
+    that does not fit: a NULL or a REAL in an INTEGER column, or text
+    in a REAL column. The kind of the values is checked first, because 
+    numpy would otherwise cast 2.5 to 2, or '3' to 3.0, without a word.
+
+    returns -- the column, which may be a new array.
+    """
+    kind = numpy.asarray(values).dtype.kind
+    if column.dtype.kind in 'iubf':
+        # NULLs can be NaN, but anything else that is not a number 
+        # needs object.
+        numbers = kind in 'iubf' or kind == 'O' and all(
+            v is None or isinstance(v, (int, float)) for v in values)
+        if not numbers:
+            column = column.astype(object)
+        elif column.dtype.kind in 'iub' and kind not in 'iub':
+            column = column.astype(numpy.float64)
+
+    while True:
+        try:
+            column[n:n+len(values)] = values
+            return column
+        except (TypeError, ValueError) as e:
+            column = column.astype(
+                numpy.float64 if column.dtype.kind in 'iub' else object)
+
+
+###
+# These expressions pick apart just enough SQL to attribute the
+# columns in WHERE and ON clauses to the tables that are scanned.
+# SQLite before 3.36 writes "SCAN TABLE jobs" where later versions 
+# write "SCAN jobs". The \b keeps a name that is followed by USING 
+# INDEX from matching by giving up its last letters.
+###
+scan_expr = re.compile(r'^SCAN (?:TABLE )?(?!TABLE\b)(\w+)\b(?! USING (?:COVERING )?INDEX)')
+table_expr = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.I)
+condition_expr = re.compile(
+    r'\b(?:WHERE|ON)\b(.*?)(?=\b(?:WHERE|JOIN|LEFT|RIGHT|INNER|OUTER|CROSS|NATURAL|'
+    r'GROUP|ORDER|LIMIT|HAVING|UNION|EXCEPT|INTERSECT|WINDOW|RETURNING)\b|;|$)', re.I | re.S)
+compare_expr = re.compile(
+    r'(?:\b(\w+)\.)?\b(\w+)\s*(==|=|<>|!=|<=|>=|<|>|\bIN\b|\bIS\b|\bLIKE\b|\bBETWEEN\b)', re.I)
+sql_keywords = frozenset(( 'WHERE', 'ON', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 
+    'CROSS', 'NATURAL', 'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'UNION', 'SET', 'USING' ))
+
+
+###
+# Named sets of PRAGMAs. Each SQLiteDB may start with one (profile=...),
+# and change to another with set_profile(). Add to the dict to define
+# new profiles. The order matters only in that journal_mode goes first.
+#
+#   bulk-load  -- large loads where the file can be rebuilt if the 
+#                   machine crashes: no syncs, a rollback journal in
+#                   RAM, a 256MB page cache.
+#   read-heavy -- reporting: the file is read through a 1GB memory map
+#                   rather than read() calls, and WAL lets readers 
+#                   proceed while a writer works.
+#   durable    -- every commit is on disc before it returns.
+###
+tuning_profiles = {
+    'bulk-load': {
+        'journal_mode': 'MEMORY',
+        'synchronous': 'OFF',
+        'cache_size': -262144,
+        'temp_store': 'MEMORY',
+        'mmap_size': 0 
+        },
+    'read-heavy': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,
+        'temp_store': 'MEMORY',
+        'mmap_size': 1<<30 
+        },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -8192,
+        'temp_store': 'DEFAULT',
+        'mmap_size': 0
+        }
+    }
+
+
+def proc_openers(name:str) -> int:
+    """
+    Count the file descriptors, across all visible processes, that
+    refer to the file name. Processes that exit during the scan, and 
+    those we are not permitted to examine, are skipped.
+
+    name -- the real path of the file.
+    """
+    n = 0
+    for pid in os.scandir('/proc'):
+        if not pid.name.isdigit(): continue
+        try:
+            for fd in os.scandir(f'/proc/{pid.name}/fd'):
+                try:
+                    n += os.readlink(fd.path) == name
+                except OSError as e:
+                    pass
+        except OSError as e:
+            pass
+    return n
+
+
+class CountingIterator:
+    """
+    Passes along the rows of an iterable, counting them, so that
+    sqlite can consume a datasource without our making a copy.
+    """
+
+    __slots__ = ('source', 'count')
+
+    def __init__(self, source:Iterable):
+        self.source = iter(source)
+        self.count = 0
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self) -> object:
+        row = next(self.source)
+        self.count += 1
+        return row
+
+
+class ManyResult(namedtuple('ManyResult',
+        'rows rowcount chunks failed_chunk error elapsed')):
+    """
+    What happened during executemany_SQL. The types are:
+
+        rows         -- int, the number of parameter sets committed.
+        rowcount     -- int, the rows affected as reported by sqlite.
+        chunks       -- int, the number of chunks committed.
+        failed_chunk -- int or None, the 0-based number of the chunk
+                            that was rolled back or could not be read.
+        error        -- str or None, why that chunk failed.
+        elapsed      -- float, seconds.
+    """
+
+    def __bool__(self) -> bool:
+        """
+        True if every chunk was committed.
+        """
+        return self.error is None
+
+
+    def __int__(self) -> int:
+        """
+        The number of rows affected, for compatibility with callers
+        that treat the result as a count.
+        """
+        return self.rowcount
+
+
+    @property
+    def rate(self) -> float:
+        """
+        Committed rows per second.
+        """
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+class StatementInfo:
+    """
+    What we know about one SQL statement: its kind, determined once
+    when the statement is first seen, and its history.
+    """
+
+    __slots__ = ( 'SQL', 'is_select', 'calls', 'total', 'rows', 'samples',
+        'plan', 'advice' )
+
+    def __init__(self, SQL:str, samples:int=1000):
+        """
+        SQL     -- the text of the statement.
+        samples -- how many of the most recent latencies to keep
+            for the percentiles.
+        """
+        self.SQL = SQL
+        self.is_select = SQL.strip().lower().startswith('select')
+        self.calls = 0
+        self.total = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=samples)
+        self.plan = None
+        self.advice = None
+
+
+    def record(self, elapsed:float, rows:int) -> None:
+        """
+        Note one execution.
+        """
+        self.calls += 1
+        self.total += elapsed
+        self.rows += max(rows, 0)
+        self.samples.append(elapsed)
+
+
+    def percentile(self, p:float) -> float:
+        """
+        The p-th percentile (0 to 100) of the recent latencies.
+        """
+        if not self.samples: return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+
+    def as_dict(self) -> dict:
+        return {
+            'SQL': self.SQL,
+            'calls': self.calls,
+            'total': self.total,
+            'mean': self.total / self.calls if self.calls else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'rows': self.rows
+            }
+
+
+class SQLitePool:
+    """
+    A bounded collection of connections to the same database file.
+    Connections are created lazily, up to size, and handed out
+    to one thread at a time. A thread that already holds a connection
+    gets the same one back, so nested calls (and explicit transactions)
+    stay on a single connection.
+
+    The connections are opened with check_same_thread=False because
+    a connection may be created by one thread and later checked out
+    by another. The pool guarantees that only one thread at a time
+    is using it.
+    """
+
+    def __init__(self, name:str, size:int,
+            timeout:int=15,
+            isolation_level:str='DEFERRED',
+            pragmas:Iterable=(),
+            cached_statements:int=128):
+        """
+        name    -- the (real)path to the database.
+        size    -- the maximum number of connections.
+        timeout -- seconds to wait for the database, and for a
+            connection to become free.
+        isolation_level -- passed to sqlite3.connect().
+        pragmas -- statements executed on each new connection.
+        cached_statements -- passed to sqlite3.connect().
+        """
+        self.name = name
+        self.size = max(int(size), 1)
+        self.timeout = timeout
+        self.isolation_level = isolation_level
+        self.pragmas = tuple(pragmas)
+        self.cached_statements = cached_statements
+
+        self.idle = queue.LifoQueue()
+        self.guard = threading.Lock()
+        self.local = threading.local()
+        self.connections = []
+        self.generation = 0
+        self.applied = {}
+
+        # Statistics.
+        self.checkouts = 0
+        self.in_use = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open one more connection and prepare it.
+        """
+        db = sqlite3.connect(self.name,
+            timeout=self.timeout,
+            isolation_level=self.isolation_level,
+            check_same_thread=False,
+            cached_statements=self.cached_statements)
+        self.prepare(db)
+        return db
+
+
+    def prepare(self, db:sqlite3.Connection) -> None:
+        """
+        Run the pragmas on a connection, unless it has already run
+        the current ones. A pragma that cannot be applied (changing 
+        journal_mode while other connections are open, for example) 
+        is skipped.
+        """
+        generation = self.generation
+        if self.applied.get(id(db)) == generation: return
+
+        for pragma in self.pragmas:
+            try:
+                db.execute(pragma).fetchall()
+            except sqlite3.OperationalError as e:
+                pass
+        self.applied[id(db)] = generation
+
+
+    def set_pragmas(self, pragmas:Iterable) -> None:
+        """
+        Replace the pragmas. Each connection runs the new ones the
+        next time it is checked out.
+        """
+        with self.guard:
+            self.pragmas = tuple(pragmas)
+            self.generation += 1
+
+
+    def checkout(self, timeout:float=None) -> sqlite3.Connection:
+        """
+        Get a connection, opening a new one if the pool has not
+        reached its size, or waiting for one to be returned.
+
+        timeout -- seconds to wait; default is the pool's timeout.
+
+        raises TimeoutError if no connection becomes free in time.
+        """
+        start = time.perf_counter()
+        try:
+            db = self.idle.get_nowait()
+
+        except queue.Empty:
+            with self.guard:
+                make_one = len(self.connections) < self.size
+                if make_one:
+                    db = self._connect()
+                    self.connections.append(db)
+
+            if not make_one:
+                try:
+                    db = self.idle.get(
+                        timeout=self.timeout if timeout is None else timeout)
+                except queue.Empty:
+                    raise TimeoutError(
+                        f"No connection to {self.name} free after {timeout or self.timeout} seconds."
+                        ) from None
+
+        self.prepare(db)
+        waited = time.perf_counter() - start
+        with self.guard:
+            self.checkouts += 1
+            self.in_use += 1
+            if waited > 0.001: self.waits += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return db
+
+
+    def checkin(self, db:sqlite3.Connection) -> None:
+        """
+        Return a connection to the pool. Anything left uncommitted
+        is committed, just as close() does for SQLiteDB.
+        """
+        try:
+            db.in_transaction and db.commit()
+        finally:
+            with self.guard:
+                self.in_use -= 1
+            self.idle.put(db)
+
+
+    @contextlib.contextmanager
+    def connection(self) -> sqlite3.Connection:
+        """
+        Context manager that pins a connection to the calling thread
+        for the duration of the with-block.
+        """
+        db = getattr(self.local, 'db', None)
+        if db is not None:
+            yield db
+            return
+
+        db = self.local.db = self.checkout()
+        try:
+            yield db
+        finally:
+            self.local.db = None
+            self.checkin(db)
+
+
+    @property
+    def stats(self) -> dict:
+        """
+        A snapshot of the pool's activity.
+        """
+        with self.guard:
+            return {
+                'size': self.size,
+                'open': len(self.connections),
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'total_wait': self.total_wait,
+                'max_wait': self.max_wait,
+                'mean_wait': self.total_wait / self.checkouts if self.checkouts else 0.0
+                }
+
+
+    def close(self) -> None:
+        """
+        Close every connection, committing any open transactions.
+        """
+        with self.guard:
+            for db in self.connections:
+                try:
+                    db.in_transaction and db.commit()
+                    db.close()
+                except sqlite3.Error as e:
+                    sys.stderr.write(f"{e}\n")
+            self.connections = []
+            self.applied = {}
+            self.idle = queue.LifoQueue()
+
+
 class SQLiteDB:
     """
     Basic functions for manipulating all sqlite3 databases. Here is
@@ -55,12 +514,67 @@ class SQLiteDB:
     to_RAM -- if True, the entire database is read into RAM on open,
         and the close() operation will write it back to wherever it
         came from. (default:False)
+
+    pool_size -- if greater than zero, the database is switched to
+        WAL journaling, and each thread that calls execute_SQL or
+        executemany_SQL gets its own connection from a pool of at most
+        this many connections. Ignored with to_RAM. (default:0)
+
+    connections_ttl -- seconds for which the value of num_connections
+        is reused before /proc is scanned again. (default:2)
+
+    checkpoint_interval -- with to_RAM, if greater than zero, a 
+        background thread writes the in-memory database back to disc
+        this often (seconds), but only if it has changed. (default:0)
+
+    checkpoint_pages -- with to_RAM, the number of pages copied in
+        each step of a checkpoint. Writers get a turn between steps.
+        (default:1024)
+
+    statement_cache_size -- the number of distinct SQL statements for
+        which sqlite keeps the prepared statement, and for which we keep
+        call counts and latencies. See query_report(). (default:128)
+
+    slow_query -- if greater than zero, any statement that takes longer
+        than this many seconds is reported to the logger. (default:0)
+
+    logger -- an object with a warning() method, such as a URLogger. If
+        None, slow queries are written to stderr. (default:None)
+
+    advise -- if True, each new SELECT, UPDATE or DELETE is run through
+        EXPLAIN QUERY PLAN, and full scans of tables with at least 
+        advise_rows rows are noted, along with an index that would 
+        avoid them. See index_advice(). (default:False)
+
+    advise_rows -- see advise. (default:10000)
+
+    profile -- the name of one of the tuning_profiles, applied at open.
+        See set_profile(). (default:None)
+
+    writer -- the path of a Unix socket. If given, execute_SQL (for
+        statements other than SELECT), executemany_SQL and commit send
+        their writes to whichever process owns the socket, becoming
+        the owner if there is none. See sqlitewriter.py. Reads are
+        unaffected, and the database is switched to WAL journaling 
+        so that they do not wait for the writer. (default:None)
     """
 
     __slots__ = ( 'stmt', 'OK', 'db', 'cursor', 
-        'timeout', 'isolation_level', 'name', 'use_pandas', 'to_RAM', 'lock' )
+        'timeout', 'isolation_level', 'name', 'use_pandas', 'to_RAM', 'lock',
+        'pool_size', 'pool', 'connections_ttl', 'connections_seen',
+        'checkpoint_interval', 'checkpoint_pages', 'checkpoint_changes',
+        'checkpoint_lock', 'checkpointer', 'checkpoint_stop',
+        'statement_cache_size', 'statements', 'statement_lock', 
+        'slow_query', 'logger', 'writer', 'write_client', 'pending_writes',
+        'advise', 'advise_rows', 'table_sizes', 'profile', 'keys' )
     __values__ = ( '', False, None, None,
-        15, 'DEFERRED', '', True, False, multiprocessing.RLock() )
+        15, 'DEFERRED', '', True, False, multiprocessing.RLock(),
+        0, None, 2, None,
+        0, 1024, 0,
+        None, None, None,
+        128, None, None,
+        0, None, None, None, None,
+        False, 10000, None, None, True )
     __defaults__ = dict(zip(
         __slots__, __values__
         ))
@@ -84,19 +598,55 @@ class SQLiteDB:
             if k in SQLiteDB.__slots__:
                 setattr(self, k, v)
 
+        self.statements = OrderedDict()
+        self.statement_lock = threading.Lock()
+        self.table_sizes = {}
+
         error_on_init = True
         try:
             self.db = sqlite3.connect(self.name, 
-                timeout=self.timeout, isolation_level=self.isolation_level)
+                timeout=self.timeout, isolation_level=self.isolation_level,
+                cached_statements=self.statement_cache_size)
 
             if self.to_RAM:
-                memDB = sqlite3.connect(':memory:')
+                memDB = sqlite3.connect(':memory:', 
+                    isolation_level=self.isolation_level,
+                    check_same_thread=False,
+                    cached_statements=self.statement_cache_size)
                 self.db.backup(memDB, pages=0, progress=None)
                 self.db.close()
                 self.db = memDB
+                self.checkpoint_changes = memDB.total_changes
+                self.checkpoint_lock = threading.Lock()
+
+                if self.checkpoint_interval > 0:
+                    self.checkpoint_stop = threading.Event()
+                    self.checkpointer = threading.Thread(
+                        target=self._checkpoint_loop, daemon=True,
+                        name=f'checkpoint {self.name}')
+                    self.checkpointer.start()
                 
             self.cursor = self.db.cursor()
             self.keys_on()
+
+            if self.pool_size > 0 and not self.to_RAM:
+                self.cursor.execute('pragma journal_mode = WAL').fetchall()
+                self.pool = SQLitePool(self.name, self.pool_size,
+                    timeout=self.timeout,
+                    isolation_level=self.isolation_level,
+                    pragmas=self.pool_pragmas(),
+                    cached_statements=self.statement_cache_size)
+
+            self.profile and self.set_profile(self.profile)
+
+            if self.writer and not self.to_RAM:
+                from sqlitewriter import WriteClient
+                self.pending_writes = []
+                self.write_client = WriteClient(self.writer, self.name,
+                    timeout=self.timeout, isolation_level=self.isolation_level,
+                    profile=self.profile)
+                self.write_client.connect()
+
             error_on_init = False
 
         except sqlite3.OperationalError as e:
@@ -131,6 +681,36 @@ class SQLiteDB:
         return self.db
 
 
+    @contextlib.contextmanager
+    def connection(self) -> sqlite3.Connection:
+        """
+        Context manager that yields the connection the calling thread
+        should use. Without a pool, this is always self.db. With a pool,
+        the thread holds the same pooled connection until the outermost
+        with-block exits, so a multi-statement transaction can be
+        written as:
+
+            with db.connection():
+                db.execute_SQL(..., transaction=True)
+                db.execute_SQL(..., transaction=True)
+                db.commit()
+        """
+        if self.pool is None:
+            yield self.db
+        else:
+            with self.pool.connection() as db:
+                yield db
+
+
+    @property
+    def pool_stats(self) -> dict:
+        """
+        Size, checkout counts, and wait times of the pool, or an
+        empty dict if this object is not pooled.
+        """
+        return {} if self.pool is None else self.pool.stats
+
+
     @property
     def num_connections(self) -> int:
         """
@@ -140,6 +720,11 @@ class SQLiteDB:
             even if this process does not have the database currently
             open.
 
+        The count is the number of file descriptors, in all the processes
+        we can see, that refer to the database file. It is found by
+        scanning /proc/*/fd, and the answer is reused for connections_ttl
+        seconds. Where there is no /proc, lsof is used instead.
+
         returns:
             -1 : if the name is invalid.
              0 : if the database is not open at all.
@@ -148,7 +733,28 @@ class SQLiteDB:
         if not self.name: return -1
         if not os.path.exists(self.name): return -1
 
-        return max(len(dorunrun(f"lsof {self.name}", return_datatype=str).split()) - 1, 0)
+        now = time.monotonic()
+        if self.connections_seen is not None:
+            when, n = self.connections_seen
+            if now - when < self.connections_ttl: return n
+
+        n = ( proc_openers(self.name) 
+            if os.path.isdir('/proc/self/fd') else 
+            self.lsof_connections() )
+        self.connections_seen = now, n
+        return n
+
+
+    def lsof_connections(self) -> int:
+        """
+        The number of open connections according to lsof. This is
+        much slower than the /proc scan, and is kept for systems
+        without /proc, and for comparison.
+        """
+        if not self.name or not os.path.exists(self.name): return -1
+
+        text = dorunrun(f"lsof {self.name}", return_datatype=str) or ""
+        return max(len(text.strip().splitlines()) - 1, 0)
         
     
     def __invert__(self) -> int:
@@ -160,14 +766,63 @@ class SQLiteDB:
         return self.num_connections
 
 
+    def pool_pragmas(self) -> List[str]:
+        """
+        The statements that prepare each pooled connection.
+        """
+        settings = tuning_profiles.get(self.profile, {}) if self.profile else {}
+        keys = [ 'pragma foreign_keys = 1', 'pragma synchronous = FULL'
+            ] if self.keys else [
+            'pragma foreign_keys = 0', 'pragma synchronous = OFF' ]
+        return keys + [
+            f'pragma {k} = {v}' for k, v in settings.items() ]
+
+
+    def set_profile(self, name:str) -> dict:
+        """
+        Apply one of the tuning_profiles, at open or at any time 
+        afterwards. Pooled connections pick up the new settings when 
+        they are next checked out.
+
+        name -- the name of a profile.
+
+        returns -- a dict of the settings now in effect on the main
+            connection. sqlite may not grant everything requested. For
+            example, journal_mode cannot leave WAL while others have
+            the database open, and mmap_size is capped when sqlite is
+            compiled.
+        """
+        settings = tuning_profiles[name]
+        self.profile = name
+        in_effect = {}
+        for k, v in settings.items():
+            try:
+                self.cursor.execute(f'pragma {k} = {v}').fetchall()
+            except sqlite3.OperationalError as e:
+                sys.stderr.write(f"pragma {k} = {v}: {e}\n")
+            # Some pragmas (mmap_size on :memory:) have no value to read.
+            row = self.cursor.execute(f'pragma {k}').fetchone()
+            in_effect[k] = row[0] if row else None
+
+        if self.pool is not None:
+            self.pool.set_pragmas(self.pool_pragmas())
+        return in_effect
+
+
     def keys_off(self) -> None:
+        self.keys = False
         self.cursor.execute('pragma foreign_keys = 0')
         self.cursor.execute('pragma synchronous = OFF')
+        if self.pool is not None:
+            self.pool.set_pragmas(self.pool_pragmas())
 
 
     def keys_on(self) -> None:
+        self.keys = True
         self.cursor.execute('pragma foreign_keys = 1')
         self.cursor.execute('pragma synchronous = FULL')
+        if self.pool is not None:
+            self.pool.set_pragmas(self.pool_pragmas())
 
 
     @trap
@@ -179,9 +834,14 @@ class SQLiteDB:
 
         # Commit any pending transactions.
         self.commit()
+        if self.pool is not None: self.pool.close()
+        if self.write_client is not None: 
+            self.write_client.close()
+            self.write_client = None
 
         # First, check to see if other processes have the
-        # the database open.
+        # the database open. Do not trust an old count.
+        self.connections_seen = None
         if self.num_connections > 1: return True
 
         if not self.to_RAM:
@@ -189,22 +849,12 @@ class SQLiteDB:
             return False if not self.db else self.db.close()
 
         else:
-            # Let's not overwrite the existing DB until
-            # we have saved the in-memory data.
-            db_dir, _ = os.path.split(self.name)
-            temp_db_name = os.path.join(db_dir,
-                next(tempfile._get_candidate_names()))
+            if self.checkpointer is not None:
+                self.checkpoint_stop.set()
+                self.checkpointer.join()
 
             try:
-                # Create a new DB that is empty, and run backup
-                # to it.
-                temp_db = sqlite3.connect(temp_db_name)
-                self.db.backup(temp_db, pages=0, progress=None)
-
-                # Delete the original database.
-                os.unlink(self.name)
-                # Create a link to it.
-                os.link(temp_db_name, self.name)
+                self.checkpoint(force=True)
 
             except Exception as e:
                 print(f"Exception raised saving in-memory database.\n{e=}")  
@@ -216,7 +866,69 @@ class SQLiteDB:
             finally:
                 self.OK = False
                 self.db.close()
-                os.unlink(temp_db_name)
+
+
+    def checkpoint(self, force:bool=False) -> bool:
+        """
+        Write a to_RAM database back to disc. Nothing is written unless
+        the database has changed since the last checkpoint, or force
+        is True.
+
+        The data are copied checkpoint_pages at a time into a temporary
+        file in the same directory, and the temporary file is then renamed
+        over the original. The database on disc is always either the 
+        old copy or the new one, never a partial one. A checkpoint that 
+        finds a transaction in progress gives up (without writing) so 
+        that uncommitted data never reach the disc.
+
+        returns -- True if the database was written.
+        """
+        if not self.to_RAM: return False
+
+        with self.checkpoint_lock:
+            changes = self.db.total_changes
+            if not force and changes == self.checkpoint_changes: return False
+
+            def progress(status:int, remaining:int, total:int) -> None:
+                if self.db.in_transaction and not force:
+                    raise InterruptedError('transaction in progress')
+
+            # Let's not overwrite the existing DB until
+            # we have saved the in-memory data.
+            db_dir, _ = os.path.split(self.name)
+            fd, temp_db_name = tempfile.mkstemp(dir=db_dir, suffix='.checkpoint')
+            os.close(fd)
+            try:
+                temp_db = sqlite3.connect(temp_db_name)
+                try:
+                    self.db.backup(temp_db, pages=self.checkpoint_pages, 
+                        progress=progress)
+                finally:
+                    temp_db.close()
+
+                if os.path.exists(self.name):
+                    os.chmod(temp_db_name, os.stat(self.name).st_mode & 0o7777)
+                os.replace(temp_db_name, self.name)
+
+            except InterruptedError as e:
+                return False
+
+            finally:
+                os.path.exists(temp_db_name) and os.unlink(temp_db_name)
+
+            self.checkpoint_changes = changes
+            return True
+
+
+    def _checkpoint_loop(self) -> None:
+        """
+        Body of the background checkpoint thread.
+        """
+        while not self.checkpoint_stop.wait(self.checkpoint_interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                sys.stderr.write(f"checkpoint of {self.name} failed: {e}\n")
 
 
     @trap
@@ -224,35 +936,215 @@ class SQLiteDB:
         """
         Expose this function so that it can be called without having
         to put the dot-notation in the calling code.
+
+        In writer mode, the pending statements are sent to the owner.
+        If the owner rolls them back, or none takes them in time, they
+        are discarded, the reason is reported to the logger, and the
+        result is False. A ConnectionError is raised rather than
+        reported, because the statements may or may not have been
+        applied.
         """
         try:
-            self.db.commit()
+            if self.write_client is not None and self.pending_writes:
+                self.flush_writes()
+            with self.connection() as db:
+                db.commit()
             return True
-        except:
+
+        except (sqlite3.DatabaseError, TimeoutError) as e:
+            message = f"commit to {self.name} failed: {type(e).__name__}: {e}"
+            if self.logger is not None:
+                self.logger.warning(message)
+            else:
+                sys.stderr.write(message + '\n')
             return False
 
+
+    def flush_writes(self) -> list:
+        """
+        In writer mode, send the statements accumulated with
+        transaction=True to the owner as one batch.
+
+        returns -- a WriteResult, with the rowcount and lastrowid, for
+            each statement.
+        """
+        batch, self.pending_writes = self.pending_writes, []
+        return self.write_client.submit(batch) if batch else []
+
     @trap
-    def executemany_SQL(self, SQL:str, datasource:Iterable) -> int:
+    def executemany_SQL(self, SQL:str, datasource:Iterable,
+            chunk_size:int=0,
+            pragmas:dict=None,
+            progress:Callable=None) -> ManyResult:
         """
         Wrapper for multiple INSERT and UPDATE statements that provides
         a correctly constructed transaction/rollback. The datasource 
         can be a pandas DataFrame if pandas is present.
 
-        returns -- the number of rows affected.
+        chunk_size -- if greater than zero, commit after every chunk_size
+            rows rather than wrapping the whole datasource in one
+            transaction. A failure rolls back only the current chunk, 
+            and no further chunks are attempted.
+        pragmas -- a dict of PRAGMA settings, such as 
+            {'journal_mode':'MEMORY', 'synchronous':'OFF', 'cache_size':-262144}, 
+            or the name of one of the tuning_profiles, in effect only for
+            the duration of the load. The original values are restored
+            afterwards.
+        progress -- a function called after each commit as
+            progress(rows_so_far, rows_per_second).
+
+        returns -- a ManyResult. int(result) is the number of rows affected,
+            and bool(result) is False if a chunk was rolled back.
         """
 
         if we_have_pandas and isinstance(datasource, pandas.DataFrame):
             datasource = datasource.itertuples(index=False, name=None)
 
-        i = -1
-        self.cursor.execute('BEGIN TRANSACTION;')
-        try:
-            i = self.cursor.executemany(SQL, datasource)
-            self.cursor.execute('COMMIT;')
-        except:
-            self.cursor.execute('ROLLBACK;')
-        finally:
-            return i            
+        if isinstance(pragmas, str):
+            pragmas = tuning_profiles[pragmas]
+
+        datasource = iter(datasource)
+        rows = rowcount = chunks = 0
+        failed_chunk = error = None
+        start = time.perf_counter()
+
+        with self.connection() as db:
+            cursor = self.cursor if db is self.db else db.cursor()
+
+            # Note the current values before changing anything. In
+            # writer mode, the settings belong to the owner. Some pragmas
+            # (mmap_size on :memory:) have no value to read, and so none
+            # to restore.
+            saved = {}
+            for k, v in (pragmas or {}).items():
+                if self.write_client is not None: break
+                row = cursor.execute(f'pragma {k}').fetchone()
+                if row is not None: saved[k] = row[0]
+                cursor.execute(f'pragma {k} = {v}').fetchall()
+
+            try:
+                while True:
+                    # Reading the datasource can fail as well as writing;
+                    # either way the chunk is recorded as the failed one.
+                    try:
+                        if chunk_size > 0:
+                            chunk = list(itertools.islice(datasource, chunk_size))
+                            if not chunk: break
+                        else:
+                            # One chunk of everything, streamed rather than copied.
+                            first = next(datasource, self)
+                            if first is self: break
+                            chunk = CountingIterator(itertools.chain((first,), datasource))
+
+                        if self.write_client is not None:
+                            affected = self.write_client.executemany(SQL, chunk).rowcount
+                        else:
+                            cursor.execute('BEGIN TRANSACTION;')
+                            try:
+                                affected = cursor.executemany(SQL, chunk).rowcount
+                                cursor.execute('COMMIT;')
+                            except:
+                                cursor.execute('ROLLBACK;')
+                                raise
+                    except Exception as e:
+                        failed_chunk, error = chunks, f"{type(e).__name__}: {e}"
+                        break
+
+                    chunks += 1
+                    rows += len(chunk) if chunk_size > 0 else chunk.count
+                    rowcount += max(affected, 0)
+                    if progress is not None:
+                        elapsed = time.perf_counter() - start
+                        progress(rows, rows / elapsed if elapsed else 0.0)
+                    if chunk_size <= 0: break
+
+            finally:
+                for k, v in saved.items():
+                    cursor.execute(f'pragma {k} = {v}').fetchall()
+
+        self.record(self.statement(SQL), start, rowcount)
+        return ManyResult(rows, rowcount, chunks, failed_chunk, error,
+            time.perf_counter() - start)
+
+
+    def upsert(self, table:str, keys:Iterable[str], datasource:Iterable,
+            columns:Iterable[str]=None) -> dict:
+        """
+        Insert the rows of datasource into table, updating the rows
+        whose keys are already present. The rows are first loaded into
+        a temporary table with executemany, and then merged with a 
+        single INSERT ... ON CONFLICT DO UPDATE, all in one transaction.
+        The staging table belongs to this connection, so even in writer
+        mode, upsert writes directly.
+
+        table   -- the table to change. The keys must be the columns of
+            its primary key or of a unique index.
+        keys    -- the names of the key columns.
+        datasource -- an iterable of tuples, or a pandas DataFrame.
+        columns -- the names of the columns in each tuple. The default
+            is the DataFrame's columns, or else all of the table's 
+            columns, in order.
+
+        returns -- {'inserted': n, 'updated': m}, counting rows of the
+            table. If a key appears more than once in datasource, its
+            last row is the one merged, and it is counted once. When
+            every column is a key there is nothing to update, and the
+            rows already present are left alone and not counted.
+        """
+        if we_have_pandas and isinstance(datasource, pandas.DataFrame):
+            columns = list(datasource.columns) if columns is None else columns
+            datasource = datasource.itertuples(index=False, name=None)
+
+        keys = list(keys)
+        start = time.perf_counter()
+        with self.connection() as db:
+            cursor = self.cursor if db is self.db else db.cursor()
+            if columns is None:
+                columns = [ row[1] for row in cursor.execute(f'PRAGMA table_info({table})') ]
+            columns = list(columns)
+
+            # The WHERE true is required by sqlite's parser to tell the
+            # ON CONFLICT clause from a join constraint.
+            stage_name = f'"upsert_{table.replace(".", "_")}"'
+            stage = f'temp.{stage_name}'
+            names = ', '.join(f'"{c}"' for c in columns)
+            key_names = ', '.join(f'"{k}"' for k in keys)
+            matched = ' AND '.join(f't."{k}" = s."{k}"' for k in keys)
+            changes = ', '.join(f'"{c}" = excluded."{c}"' for c in columns if c not in keys)
+            # Rows with a NULL key never conflict, so they are all kept.
+            repeats = ( f'DELETE FROM {stage} WHERE rowid NOT IN '
+                f'(SELECT MAX(rowid) FROM {stage} GROUP BY {key_names}) AND NOT (' +
+                ' OR '.join(f'"{k}" IS NULL' for k in keys) + ')' )
+            merge = ( f'INSERT INTO {table} ({names}) SELECT {names} FROM {stage} WHERE true '
+                f'ON CONFLICT ({key_names}) ' +
+                (f'DO UPDATE SET {changes}' if changes else 'DO NOTHING') )
+
+            cursor.execute(f'DROP TABLE IF EXISTS {stage}')
+            cursor.execute(f'CREATE TEMP TABLE {stage_name} AS SELECT {names} FROM {table} WHERE 0')
+            cursor.execute('BEGIN TRANSACTION;')
+            try:
+                cursor.executemany(
+                    f'INSERT INTO {stage} VALUES ({", ".join("?" * len(columns))})', 
+                    datasource)
+                cursor.execute(repeats)
+                updated = cursor.execute(
+                    f'SELECT COUNT(*) FROM {stage} s WHERE EXISTS '
+                    f'(SELECT 1 FROM {table} t WHERE {matched})').fetchone()[0]
+                before = db.total_changes
+                cursor.execute(merge)
+                total = db.total_changes - before
+                cursor.execute('COMMIT;')
+
+            except:
+                cursor.execute('ROLLBACK;')
+                raise
+
+            finally:
+                cursor.execute(f'DROP TABLE IF EXISTS {stage}')
+
+        self.record(self.statement(merge), start, total)
+        if not changes: updated = 0
+        return {'inserted': total - updated, 'updated': updated}
 
 
     #@trap
@@ -265,27 +1157,353 @@ class SQLiteDB:
         has_args         -- to avoid the problem with the None-tuple.
         self.use_pandas  -- iff True, return a DataFrame on SELECT statements.
 
+        In writer mode, a statement other than a SELECT is sent to the
+        owner of the writes, and the result is a WriteResult whose
+        rowcount and lastrowid are those of the owner's cursor (or None, 
+        if transaction=True has delayed it until the next commit).
+
+        If the keyword stream=True is supplied with a SELECT, the
+        result is the generator from stream_SQL(), and the other
+        keywords are passed along to it. Similarly, columnar=True
+        returns the result of columns_SQL().
         """ 
         global we_have_pandas
        
         docommit = kwargs.get('transaction') is None
-        is_select = SQL.strip().lower().startswith('select')
+        info = self.statement(SQL)
+        is_select = info.is_select
         has_args = not not args
 
-        if we_have_pandas and self.use_pandas and is_select:
-            return pandas.read_sql_query(SQL, self.db, *args)
+        if is_select and kwargs.pop('stream', False):
+            kwargs.pop('transaction', None)
+            return self.stream_SQL(SQL, *args, **kwargs)
+
+        if is_select and kwargs.pop('columnar', False):
+            kwargs.pop('transaction', None)
+            return self.columns_SQL(SQL, *args, **kwargs)
+
+        if self.write_client is not None and not is_select:
+            self.pending_writes.append((SQL, args, False))
+            return None if not docommit else self.flush_writes()[-1]
+
+        start = time.perf_counter()
+        with self.connection() as db:
+            self.advise and info.plan is None and self.explain(db, info, args)
+            if we_have_pandas and self.use_pandas and is_select:
+                rval = pandas.read_sql_query(SQL, db, *args)
+                self.record(info, start, len(rval))
+                return rval
         
-        if has_args:
-            rval = self.cursor.execute(SQL, args)
-        else:
-            rval = self.cursor.execute(SQL)
+            cursor = self.cursor if db is self.db else db.cursor()
+            if has_args:
+                rval = cursor.execute(SQL, args)
+            else:
+                rval = cursor.execute(SQL)
+
+            if is_select: 
+                rows = rval.fetchall()
+                self.record(info, start, len(rows))
+                return rows
+            docommit and db.commit()
+            self.record(info, start, rval.rowcount)
+            return rval
+
+
+    def columns_SQL(self, SQL:str, *args,
+            batch_size:int=65536,
+            arrow:bool=False) -> Union[dict, object]:
+        """
+        Run a SELECT, and return the result by columns rather than
+        by rows. The rows are fetched batch_size at a time and copied
+        directly into numpy arrays whose types come from the declared
+        types of the columns, so no DataFrame or per-row objects are
+        built along the way.
+
+        batch_size -- the number of rows per fetchmany(), and the
+            initial size of the arrays, which double as needed.
+        arrow -- if True, return a pyarrow.Table.
+
+        returns -- a dict of column name -> numpy array, or a Table.
+
+        NOTE: an INTEGER column that contains NULLs is returned as
+            float64 with NaN in place of the NULLs.
+        """
+        if not we_have_numpy:
+            raise Exception('columns_SQL requires numpy.')
+        if arrow and not we_have_arrow:
+            raise Exception('arrow=True requires pyarrow.')
+
+        info = self.statement(SQL)
+        start = time.perf_counter()
+        with self.connection() as db:
+            # A view cannot contain parameters, so when there are
+            # args, the types come from the data alone.
+            decltypes = [] if args else self.declared_types(db, SQL)
+            self.advise and info.plan is None and self.explain(db, info, args)
+
+            cursor = db.cursor()
+            cursor.arraysize = batch_size
+            cursor.execute(SQL, args) if args else cursor.execute(SQL)
+            names = [ d[0] for d in cursor.description ]
+            decltypes = decltypes or [''] * len(names)
+
+            columns = None
+            n = 0
+            try:
+                while True:
+                    rows = cursor.fetchmany()
+                    if not rows: break
+                    k = len(rows)
+                    if columns is None:
+                        columns = [ numpy.empty(max(batch_size, k), 
+                            dtype=column_dtype(decltypes[i], 
+                                next((r[i] for r in rows if r[i] is not None), None)))
+                            for i in range(len(names)) ]
+
+                    elif n + k > len(columns[0]):
+                        for c in columns: c.resize(2 * (n + k), refcheck=False)
+
+                    for i, values in enumerate(zip(*rows)):
+                        columns[i] = store_column(columns[i], n, values)
+                    n += k
+
+            finally:
+                cursor.close()
+
+        if columns is None:
+            columns = [ numpy.empty(0, dtype=column_dtype(t)) for t in decltypes ]
+        for c in columns: c.resize(n, refcheck=False)
+
+        self.record(info, start, n)
+        result = dict(zip(names, columns))
+        return pyarrow.table(result) if arrow else result
+
+
+    def declared_types(self, db:sqlite3.Connection, SQL:str) -> List[str]:
+        """
+        The declared types of the columns of a SELECT, found by
+        putting the SELECT in a temporary view and asking for the
+        view's table_info.
+
+        returns -- a list of types ('' for expressions), or an 
+            empty list if the SELECT cannot be made into a view.
+        """
+        view = f'columns_{os.getpid()}_{threading.get_ident()}'
+        try:
+            db.execute(f'CREATE TEMP VIEW {view} AS {SQL.strip().rstrip(";")}')
+            try:
+                return [ row[2] for row in db.execute(f'PRAGMA table_info({view})') ]
+            finally:
+                db.execute(f'DROP VIEW temp.{view}')
+        except sqlite3.Error as e:
+            return []
+
+
+    def explain(self, db:sqlite3.Connection, info:StatementInfo, args:tuple) -> None:
+        """
+        Record the query plan of a statement, and if it scans a large 
+        table, an index that might help. The candidate columns are
+        those compared in the WHERE and ON clauses, equality tests
+        first, as that is the order in which an index can use them.
+        """
+        info.plan = []
+        info.advice = []
+        if info.SQL.lstrip()[:6].upper() not in ('SELECT', 'UPDATE', 'DELETE'): return
+
+        try:
+            info.plan = [ row[3] for row in 
+                db.execute(f'EXPLAIN QUERY PLAN {info.SQL}', args) ]
+        except sqlite3.Error as e:
+            return
+
+        # Only the comparisons in the conditions, not the assignments
+        # of an UPDATE or the expressions of a select list.
+        conditions = ' '.join(condition_expr.findall(info.SQL))
+
+        # Map aliases (and names) to tables.
+        tables = {}
+        for table, alias in table_expr.findall(info.SQL):
+            tables[table.lower()] = table
+            if alias and alias.upper() not in sql_keywords:
+                tables[alias.lower()] = table
+
+        for step in info.plan:
+            scanned = scan_expr.match(step)
+            if not scanned: continue
+            name = scanned.group(1).lower()
+            table = tables.get(name, scanned.group(1))
+            rows = self.table_size(db, table)
+            if rows < self.advise_rows: continue
+
+            columns = { row[1].lower(): row[1] for row in 
+                db.execute(f'PRAGMA table_info({table})') }
+            equal, ranged = [], []
+            for qualifier, column, op in compare_expr.findall(conditions):
+                if qualifier and qualifier.lower() not in (name, table.lower()): continue
+                column = columns.get(column.lower())
+                if column is None or column in equal or column in ranged: continue
+                (equal if op.upper() in ('=', '==', 'IN', 'IS') else ranged).append(column)
 
-        if is_select: 
-            return rval.fetchall()
-        docommit and self.commit()
-        return rval
+            candidates = tuple(equal + ranged)
+            info.advice.append({
+                'table': table,
+                'rows': rows,
+                'columns': candidates,
+                'create': ( f'CREATE INDEX {table}_{"_".join(candidates)} '
+                    f'ON {table}({", ".join(candidates)})' if candidates else None )
+                })
 
 
+    def table_size(self, db:sqlite3.Connection, table:str) -> int:
+        """
+        A cheap estimate of the number of rows in a table: the largest
+        rowid, or a count for WITHOUT ROWID tables. The estimate is 
+        kept for the life of the object.
+        """
+        if table not in self.table_sizes:
+            try:
+                n = db.execute(f'SELECT MAX(rowid) FROM {table}').fetchone()[0]
+            except sqlite3.Error as e:
+                try:
+                    n = db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                except sqlite3.Error as e:
+                    n = 0
+            self.table_sizes[table] = n or 0
+        return self.table_sizes[table]
+
+
+    def index_advice(self) -> List[dict]:
+        """
+        The advice from all the statements in the cache, one entry per
+        suggested index, with the statements that would benefit, most
+        time-consuming first.
+        """
+        advice = {}
+        with self.statement_lock:
+            for info in self.statements.values():
+                for a in info.advice or ():
+                    entry = advice.setdefault((a['table'], a['columns']), 
+                        dict(a, statements=[], calls=0, total=0.0))
+                    entry['statements'].append(info.SQL)
+                    entry['calls'] += info.calls
+                    entry['total'] += info.total
+
+        return sorted(advice.values(), key=lambda d: d['total'], reverse=True)
+
+
+    def statement(self, SQL:str) -> StatementInfo:
+        """
+        Find (or create) the StatementInfo for this SQL text. The
+        cache holds the most recently used statement_cache_size
+        statements.
+        """
+        with self.statement_lock:
+            info = self.statements.get(SQL)
+            if info is None:
+                info = self.statements[SQL] = StatementInfo(SQL)
+                if len(self.statements) > self.statement_cache_size:
+                    self.statements.popitem(last=False)
+            else:
+                self.statements.move_to_end(SQL)
+            return info
+
+
+    def record(self, info:StatementInfo, start:float, rows:int) -> None:
+        """
+        Note the time since start, and the rows, against the
+        statement, and complain if the statement was slow.
+        """
+        elapsed = time.perf_counter() - start
+        with self.statement_lock:
+            info.record(elapsed, rows)
+
+        if 0 < self.slow_query < elapsed:
+            message = f"slow query ({elapsed:.3f}s, {rows} rows): {info.SQL}"
+            if self.logger is not None:
+                self.logger.warning(message)
+            else:
+                sys.stderr.write(message + '\n')
+
+
+    def query_report(self, n:int=None) -> List[dict]:
+        """
+        Calls, total and percentile latencies (in seconds), and rows
+        for each statement in the cache, most expensive first.
+
+        n -- if given, only the top n statements.
+        """
+        with self.statement_lock:
+            report = [ info.as_dict() for info in self.statements.values() ]
+        report.sort(key=lambda d: d['total'], reverse=True)
+        return report if n is None else report[:n]
+
+
+
+    def stream_SQL(self, SQL:str, *args,
+            batch_size:int=1000,
+            batches:bool=False,
+            chunksize:int=None) -> Iterator:
+        """
+        Generator that runs a SELECT and yields its results lazily,
+        so that a scan of a large table runs in constant memory.
+
+        batch_size -- the number of rows requested from sqlite with
+            each call to fetchmany().
+        batches    -- if True, yield each list of batch_size rows
+            rather than the rows one at a time.
+        chunksize  -- if given, and pandas is present, yield pandas
+            DataFrames of (at most) this many rows.
+
+        The query runs on its own cursor, so calls to execute_SQL may
+        be made while the generator is suspended. With a pool, the
+        generator holds a connection until it is exhausted or closed.
+        """
+        db = self.db
+        borrowed = None
+        if self.pool is not None:
+            db = getattr(self.pool.local, 'db', None)
+            if db is None:
+                db = borrowed = self.pool.checkout()
+
+        # Only the time spent in sqlite is charged to the statement,
+        # not the time the caller spends with each batch.
+        info = self.statement(SQL)
+        elapsed = 0.0
+        n = 0
+        try:
+            self.advise and info.plan is None and self.explain(db, info, args)
+            if chunksize and we_have_pandas:
+                start = time.perf_counter()
+                for frame in pandas.read_sql_query(SQL, db,
+                        params=args if args else None, chunksize=chunksize):
+                    elapsed += time.perf_counter() - start
+                    n += len(frame)
+                    yield frame
+                    start = time.perf_counter()
+                return
+
+            start = time.perf_counter()
+            cursor = db.cursor()
+            cursor.arraysize = batch_size
+            cursor.execute(SQL, args) if args else cursor.execute(SQL)
+            try:
+                while True:
+                    rows = cursor.fetchmany()
+                    elapsed += time.perf_counter() - start
+                    if not rows: break
+                    n += len(rows)
+                    if batches:
+                        yield rows
+                    else:
+                        yield from rows
+                    start = time.perf_counter()
+            finally:
+                cursor.close()
+
+        finally:
+            borrowed is not None and self.pool.checkin(borrowed)
+            self.record(info, time.perf_counter() - elapsed, n)
+
 
     def row_one(self, SQL:str, parameters:Union[tuple, None]=None) -> dict:
         """
@@ -295,5 +1513,25 @@ class SQLiteDB:
         is returned as an atomic datum.
         """
        
-        results = self.execute_SQL(SQL, parameters)
-        return None if not results else results[0]
+        if parameters is None:
+            parameters = ()
+        elif not isinstance(parameters, (list, tuple)):
+            parameters = (parameters,)
+
+        results = self.execute_SQL(SQL, *parameters)
+        return None if not len(results) else results[0]
+
+
+if __name__ == '__main__':
+    import timeit
+
+    print("Comparing the /proc scan with lsof for num_connections.")
+    name = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        tempfile.gettempdir(), 'sqlitedb_demo.db')
+    db = SQLiteDB(name, connections_ttl=0)
+    for f, label in ((proc_openers, '/proc'), (None, 'lsof')):
+        stmt = (lambda: proc_openers(db.name)) if f else db.lsof_connections
+        n = 5 if f is None else 50
+        seconds = timeit.timeit(stmt, number=n) / n
+        print(f"{label:>6}: {stmt()} connections in {seconds*1000:.2f} ms")
+    db.close()
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+Cross-process write coordination for SQLite databases. One process
+owns the writes; the others send their writes to it over a Unix
+domain socket rather than contending for the database lock and
+waiting out SQLITE_BUSY timeouts.
+
+Usage (normally through SQLiteDB):
+
+    db = SQLiteDB('/path/to/db', writer='/path/to/db.sock')
+
+Every process that opens the database this way is a client. The
+first one to take an flock on the socket's .lock file also becomes
+the owner, and runs a WriteServer in a thread. If the owner exits, the
+next client to find the socket gone takes over.
+
+When the owner closes, it stops accepting connections, finishes the
+batches it has already begun, and answers every other batch with a
+"retry" status that means the batch was not applied. The client then
+finds (or becomes) the new owner and sends the batch again. A client
+sees a ConnectionError only when the owner went away without answering,
+and so the outcome is unknown.
+
+A batch is a list of (SQL, parameters, many) operations. The owner
+applies each batch in its own SAVEPOINT, so a batch succeeds or fails
+as a unit, and it commits all the batches that have queued up since the
+last commit in one transaction. Concurrent writers therefore share
+each fsync rather than each paying for their own.
+
+The messages are length-prefixed marshal data, so parameters must be
+the built-in types that sqlite accepts: str, int, float, bytes, None.
+The socket is created with mode 0600.
+"""
+
+import typing
+from   typing import *
+
+min_py = (3, 8)
+
+###
+# Standard imports, starting with os and sys
+###
+import os
+import sys
+if sys.version_info < min_py:
+    print(f"This program requires Python {min_py[0]}.{min_py[1]}, or higher.")
+    sys.exit(os.EX_SOFTWARE)
+
+###
+# Other standard distro imports
+###
+import fcntl
+import marshal
+import queue
+import select
+import socket
+import sqlite3
+import struct
+import threading
+import time
+from   collections import namedtuple
+
+###
+# Credits
+###
+__author__ = 'George Flanagin'
+__copyright__ = 'Copyright 2024'
+__credits__ = None
+__version__ = 0.1
+__maintainer__ = 'George Flanagin'
+__email__ = ['gflanagin@richmond.edu', 'me@georgeflanagin.com']
+__status__ = 'in progress'
+__license__ = 'MIT'
+
+
+class WriteResult(namedtuple('WriteResult', 'rowcount lastrowid')):
+    """
+    What the owner reports for one statement: the cursor attributes
+    that a caller would otherwise read from its own cursor.
+    """
+    pass
+
+
+###
+# The answer to a batch that was not applied, and may be sent again.
+###
+retry_answer = ('retry', 'the writer is closing')
+
+
+def send_message(sock:socket.socket, o:object) -> None:
+    """
+    Write one length-prefixed message.
+    """
+    data = marshal.dumps(o)
+    sock.sendall(struct.pack('!I', len(data)) + data)
+
+
+def receive_message(sock:socket.socket) -> object:
+    """
+    Read one length-prefixed message.
+
+    raises EOFError if the other end has gone away.
+    """
+    def exactly(n:int) -> bytes:
+        data = bytearray()
+        while len(data) < n:
+            shred = sock.recv(n - len(data))
+            if not shred: raise EOFError('connection closed')
+            data.extend(shred)
+        return bytes(data)
+
+    n, = struct.unpack('!I', exactly(4))
+    return marshal.loads(exactly(n))
+
+
+class WriteServer:
+    """
+    Accepts batches from any number of clients and applies them, in
+    the order received, on a single connection.
+    """
+
+    def __init__(self, socket_path:str, path_to_db:str,
+            max_group:int=256, **kwargs):
+        """
+        socket_path -- where to listen. Any stale socket is removed.
+        path_to_db  -- the database to write.
+        max_group   -- the most batches committed together.
+        kwargs      -- passed to SQLiteDB.
+        """
+        self.socket_path = socket_path
+        self.path_to_db = path_to_db
+        self.max_group = max_group
+        self.kwargs = kwargs
+        self.requests = queue.Queue()
+        self.guard = threading.Lock()
+        self.closing = False
+        self.servers = []
+        self.batches = 0
+        self.commits = 0
+
+        # The database must be opened on the thread that writes to it.
+        ready = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop, args=(ready,),
+            daemon=True, name=f'writer {path_to_db}')
+        self.writer.start()
+        error = ready.get()
+        if error is not None: raise error
+
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError as e:
+            pass
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(socket_path)
+        os.chmod(socket_path, 0o600)
+        self.listener.listen(64)
+        threading.Thread(target=self._accept_loop, daemon=True,
+            name=f'listener {socket_path}').start()
+
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError as e:
+                return
+            t = threading.Thread(target=self._serve, args=(conn,), daemon=True)
+            with self.guard:
+                if self.closing:
+                    conn.close()
+                    return
+                self.servers.append(t)
+            t.start()
+
+
+    def _serve(self, conn:socket.socket) -> None:
+        """
+        Relay one client's batches to the writer thread, and the
+        answers back. The client waits for the first message before
+        it sends anything, so that a connection the listener never
+        accepted is not mistaken for one that was lost mid-batch.
+
+        Once the server is closing, a batch that arrives is answered
+        with retry_answer, and an idle client is sent retry_answer 
+        unasked, so that whatever it sends next is sent again to the
+        new owner rather than lost.
+        """
+        reply = queue.Queue(1)
+        with conn:
+            try:
+                send_message(conn, ('ready', os.getpid()))
+                while True:
+                    if not select.select([conn], [], [], 0.1)[0]:
+                        if self.closing:
+                            send_message(conn, retry_answer)
+                            return
+                        continue
+
+                    batch = receive_message(conn)
+                    with self.guard:
+                        closing = self.closing
+                        if not closing: self.requests.put((batch, reply))
+                    send_message(conn, retry_answer if closing else reply.get())
+                    if closing: return
+
+            except (EOFError, OSError, ValueError) as e:
+                return
+
+
+    def _write_loop(self, ready:queue.Queue) -> None:
+        """
+        Apply batches, grouping those that are waiting into one
+        transaction with a SAVEPOINT for each batch.
+        """
+        from sqlitedb import SQLiteDB
+        try:
+            db = SQLiteDB(self.path_to_db, use_pandas=False, **self.kwargs)
+            if not db: raise sqlite3.OperationalError(f"cannot open {self.path_to_db}")
+            db.cursor.execute('pragma journal_mode = WAL').fetchall()
+        except Exception as e:
+            ready.put(e)
+            return
+        ready.put(None)
+        cursor = db.cursor
+
+        while True:
+            group = [self.requests.get()]
+            while len(group) < self.max_group:
+                try:
+                    group.append(self.requests.get_nowait())
+                except queue.Empty as e:
+                    break
+
+            stop = None in group
+            group = [ _ for _ in group if _ is not None ]
+
+            # Batches still waiting when close() is called are not
+            # begun. The clients will send them to the next owner.
+            if self.closing:
+                for batch, reply in group:
+                    reply.put(retry_answer)
+                if stop: break
+                continue
+
+            answers = []
+            try:
+                cursor.execute('BEGIN IMMEDIATE;')
+                for batch, reply in group:
+                    cursor.execute('SAVEPOINT batch;')
+                    try:
+                        results = []
+                        for SQL, params, many in batch:
+                            f = cursor.executemany if many else cursor.execute
+                            c = f(SQL, params)
+                            results.append((c.rowcount, c.lastrowid))
+                        cursor.execute('RELEASE batch;')
+                        answers.append(('ok', results))
+                    except Exception as e:
+                        cursor.execute('ROLLBACK TO batch;')
+                        cursor.execute('RELEASE batch;')
+                        answers.append(('error', f"{type(e).__name__}: {e}"))
+                cursor.execute('COMMIT;')
+                self.commits += 1
+
+            except Exception as e:
+                db.db.in_transaction and cursor.execute('ROLLBACK;')
+                answers = [ ('error', f"{type(e).__name__}: {e}") ] * len(group)
+
+            self.batches += len(group)
+            for (batch, reply), answer in zip(group, answers):
+                reply.put(answer)
+
+            if stop: break
+
+        db.close()
+
+
+    def close(self) -> None:
+        """
+        Stop listening, finish the batches already begun, tell every
+        client to send anything else to the next owner, and close the
+        database.
+        """
+        self.listener.close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError as e:
+            pass
+
+        # Nothing is queued after the None, so the writer answers
+        # every batch before it stops.
+        with self.guard:
+            self.closing = True
+            self.requests.put(None)
+        self.writer.join()
+
+        # Wait for the answers to be sent, so that exiting right after
+        # close() does not leave a client with no answer.
+        for t in self.servers:
+            t.join(timeout=5)
+
+
+class WriteClient:
+    """
+    Sends batches to the owner of the database's writes, becoming
+    the owner if there is none.
+    """
+
+    def __init__(self, socket_path:str, path_to_db:str,
+            timeout:float=15, **kwargs):
+        """
+        socket_path -- the owner's socket.
+        path_to_db  -- the database, in case we become the owner.
+        timeout     -- seconds to wait for an owner to appear.
+        kwargs      -- passed to the WriteServer if we become the owner.
+        """
+        self.socket_path = socket_path
+        self.path_to_db = path_to_db
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self.server = None
+        self.sock = None
+        self.guard = threading.Lock()
+        self.lock_fd = os.open(socket_path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+
+
+    @property
+    def is_owner(self) -> bool:
+        return self.server is not None
+
+
+    def connect(self) -> None:
+        """
+        Connect to the owner. If no one is listening, try to become
+        the owner; if someone else holds the lock, wait for them to
+        start listening.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                sock.settimeout(self.timeout)
+                receive_message(sock)
+                sock.settimeout(None)
+                self.sock = sock
+                return
+            except (OSError, EOFError) as e:
+                # Not listening, or closed before accepting us.
+                sock.close()
+
+            if self.server is None:
+                try:
+                    fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self.server = WriteServer(self.socket_path, self.path_to_db, **self.kwargs)
+                    continue
+                except BlockingIOError as e:
+                    pass
+
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No writer is listening on {self.socket_path}")
+            time.sleep(0.05)
+
+
+    def _disconnect(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+    def submit(self, batch:List[tuple]) -> List[WriteResult]:
+        """
+        Send a batch of (SQL, parameters, many) operations to be
+        applied in one transaction. If the owner answers that it is
+        closing, or the batch cannot be sent at all, the batch was not
+        applied, and it is sent again to the next owner (perhaps us).
+
+        returns -- a WriteResult for each operation.
+        raises  -- sqlite3.DatabaseError if the batch was rolled back, 
+            TimeoutError if no owner took the batch within the timeout, or
+            ConnectionError if the owner went away before answering. In
+            the last case, the batch may or may not have been applied.
+        """
+        batch = [ (SQL, tuple(map(tuple, params)) if many else tuple(params), many)
+            for SQL, params, many in batch ]
+        deadline = time.monotonic() + self.timeout
+        with self.guard:
+            while True:
+                if self.sock is None: self.connect()
+                try:
+                    send_message(self.sock, batch)
+                except OSError as e:
+                    # Nothing was delivered.
+                    self._disconnect()
+                    continue
+
+                try:
+                    status, answer = receive_message(self.sock)
+                except (EOFError, OSError) as e:
+                    self._disconnect()
+                    raise ConnectionError(f"lost the writer on {self.socket_path}: {e}") from None
+
+                if status != 'retry': break
+                self._disconnect()
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"No writer took the batch on {self.socket_path}")
+
+        if status != 'ok': raise sqlite3.DatabaseError(answer)
+        return [ WriteResult(*_) for _ in answer ]
+
+
+    def execute(self, SQL:str, *args) -> WriteResult:
+        return self.submit([(SQL, args, False)])[0]
+
+
+    def executemany(self, SQL:str, rows:Iterable) -> WriteResult:
+        return self.submit([(SQL, rows, True)])[0]
+
+
+    def close(self) -> None:
+        """
+        Disconnect, and if we are the owner, stop serving.
+        """
+        with self.guard:
+            self._disconnect()
+            if self.server is not None:
+                self.server.close()
+                self.server = None
+                fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+            os.close(self.lock_fd)
+            self.lock_fd = -1